@@ -0,0 +1,57 @@
+# album.py
+
+import os
+import asyncio
+
+# 相簿（media_group_id 相同的多則訊息）在最後一則到達後等待多久再一起處理
+ALBUM_DEBOUNCE_SECONDS = float(os.environ.get("ALBUM_DEBOUNCE_SECONDS", 1.0))
+# Telegram 相簿最多 10 個項目，達到時不必再等待
+ALBUM_MAX_ITEMS = 10
+
+class AlbumBuffer:
+    """以 (chat_id, media_group_id) 收集相簿中的訊息，在短暫的靜默期後一次交給 handler 處理"""
+
+    def __init__(self, handler, delay=ALBUM_DEBOUNCE_SECONDS):
+        self.handler = handler
+        self.delay = delay
+        self._albums = {}
+        self._flushing = {}
+
+    def add(self, chat_id, media_group_id, message):
+        """加入相簿中的一則訊息，並重新開始等待"""
+        key = (chat_id, media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = {'messages': [], 'timer': None}
+        else:
+            album['timer'].cancel()
+        album['messages'].append(message)
+
+        if len(album['messages']) >= ALBUM_MAX_ITEMS:
+            self._start_flush(key)
+        else:
+            album['timer'] = asyncio.get_running_loop().call_later(self.delay, self._start_flush, key)
+
+    def _start_flush(self, key):
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        if album['timer'] is not None:
+            album['timer'].cancel()
+        task = asyncio.create_task(self._run(key, album['messages']))
+        self._flushing[key] = task
+        task.add_done_callback(lambda _: self._flushing.pop(key, None))
+
+    async def _run(self, key, messages):
+        try:
+            await self.handler(key[0], messages)
+        except Exception as e:
+            print(f"Error processing album {key[1]}: {e}")
+
+    async def flush(self, chat_id=None):
+        """立即處理並等待該聊天（未指定時為全部）尚未完成的相簿"""
+        for key in [key for key in self._albums if chat_id is None or key[0] == chat_id]:
+            self._start_flush(key)
+        tasks = [task for key, task in self._flushing.items() if chat_id is None or key[0] == chat_id]
+        if tasks:
+            await asyncio.gather(*tasks)
@@ -0,0 +1,109 @@
+# archive.py
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import zipfile
+from datetime import datetime
+
+# 封存模式：列出的自定義資料夾在 /save 時將所有內容打包成一個 ZIP 上傳，* 表示所有資料夾
+ARCHIVE_FOLDERS = [name.strip() for name in os.environ.get("ARCHIVE_FOLDERS", "").split(",") if name.strip()]
+
+def is_archive_folder(folder_name):
+    """資料夾是否使用封存模式"""
+    return "*" in ARCHIVE_FOLDERS or folder_name in ARCHIVE_FOLDERS
+
+class PostArchive:
+    """逐一寫入檔案的 ZIP 封存檔，內容直接寫入磁碟上的暫存檔
+
+    圖片與影片已經過壓縮，以不壓縮 (stored) 方式存放，之後可以不解壓縮直接讀出單一檔案；
+    文字與清單以 deflate 壓縮。close 時加入 manifest.json 與 manifest.md。
+    """
+
+    def __init__(self, message_id, folder_name):
+        self.message_id = message_id
+        self.folder_name = folder_name
+        self.file = tempfile.TemporaryFile(prefix="archive-")
+        self.zip = zipfile.ZipFile(self.file, "w")
+        self.entries = []
+        self._counters = {}
+
+    def _next_name(self, kind, extension):
+        self._counters[kind] = self._counters.get(kind, 0) + 1
+        return f"{kind}_{self._counters[kind]:03d}.{extension}"
+
+    def add_text(self, text):
+        """加入一段文字，回傳封存檔中的檔名"""
+        name = self._next_name('text', 'txt')
+        data = text.encode('utf-8')
+        self.zip.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED)
+        self.entries.append({
+            'name': name, 'kind': 'text', 'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(), 'caption': '',
+        })
+        return name
+
+    def add_file(self, kind, extension, fileobj, size, content_hash, caption="", file_unique_id=None):
+        """以區塊方式複製檔案內容到封存檔（會阻塞，應在執行緒中呼叫），回傳封存檔中的檔名"""
+        name = self._next_name(kind, extension)
+        info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        with self.zip.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as target:
+            shutil.copyfileobj(fileobj, target, 1024 * 1024)
+        self.entries.append({
+            'name': name, 'kind': kind, 'size': size, 'sha256': content_hash,
+            'caption': caption, 'file_unique_id': file_unique_id,
+        })
+        return name
+
+    def content_key(self):
+        """依內容計算的識別碼：由各項目的 SHA-256 排序後雜湊，不受 ZIP 中的時間戳記影響"""
+        digest = hashlib.sha256()
+        for content_hash in sorted(entry['sha256'] for entry in self.entries):
+            digest.update(content_hash.encode('ascii'))
+        return digest.hexdigest()
+
+    def _manifest_markdown(self, created_at):
+        lines = [
+            f"# message_{self.message_id}",
+            "",
+            f"- 資料夾：{self.folder_name}",
+            f"- 建立時間：{created_at}",
+            f"- 檔案數量：{len(self.entries)}",
+            "",
+            "| 檔名 | 類型 | 大小 | 說明 |",
+            "| --- | --- | --- | --- |",
+        ]
+        for entry in self.entries:
+            caption = entry['caption'].replace("|", "\\|").replace("\n", " ")
+            lines.append(f"| {entry['name']} | {entry['kind']} | {entry['size']} | {caption} |")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """寫入清單並完成封存檔，回傳 (檔案物件, 大小, SHA-256 雜湊)；檔案物件由呼叫端關閉"""
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        manifest = {
+            'folder_name': self.folder_name,
+            'message_id': self.message_id,
+            'created_at': created_at,
+            'files': self.entries,
+        }
+        self.zip.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2),
+                          compress_type=zipfile.ZIP_DEFLATED)
+        self.zip.writestr("manifest.md", self._manifest_markdown(created_at), compress_type=zipfile.ZIP_DEFLATED)
+        self.zip.close()
+
+        size = self.file.tell()
+        self.file.seek(0)
+        digest = hashlib.sha256()
+        for block in iter(lambda: self.file.read(1024 * 1024), b''):
+            digest.update(block)
+        self.file.seek(0)
+        return self.file, size, digest.hexdigest()
+
+    def discard(self):
+        """放棄封存檔並刪除暫存檔"""
+        self.zip.close()
+        self.file.close()
@@ -1,24 +1,46 @@
 # bot.py
 
 import os
-import httpx
+import asyncio
 import sys
 from datetime import datetime
 
 # 添加當前目錄到 Python 路徑
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from gdrive import upload_text, upload_photo, upload_video, create_google_doc
+from gdrive import upload_text, upload_media, upload_archive, create_google_doc, create_post_document
+from http_client import get_client
+from storage import session_store
+from prefetch import prefetch_spool
+from summary import schedule_report_update
+from album import AlbumBuffer
+from outbox import TelegramOutbox
+from metrics import observe, trace_save, save_files
+from catalog import catalog, current_chat_id
+from media_processing import VIDEO_SOURCE_MAX_SIZE
+from transfer import TELEGRAM_LOCAL_MODE, TELEGRAM_FILE_MAX_SIZE, local_file_source
+from archive import is_archive_folder
 
 BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
+# Bot API 的位址，可改為自架的 Bot API 伺服器或 bench/ 中的模擬伺服器
+TELEGRAM_API_BASE = os.environ.get("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+TELEGRAM_API_URL = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}"
+
+# 文件模式：text 每條文字建立一份 Doc；post 每次 /save 建立一份包含所有內容的 Doc
+DOC_MODE = os.environ.get("DOC_MODE", "text").lower()
+
+# 發送給使用者的訊息依 Telegram 的速率限制排隊發送
+outbox = TelegramOutbox(TELEGRAM_API_URL)
+
+# 影片大小上限（啟用轉檔時為可接受的原始影片大小，上傳前會壓縮），不能超過 Bot API 可下載的大小
+VIDEO_MAX_SIZE = min(VIDEO_SOURCE_MAX_SIZE, TELEGRAM_FILE_MAX_SIZE)
+VIDEO_MAX_SIZE_MB = VIDEO_MAX_SIZE // (1024 * 1024)
 
 # 預設資料夾名稱
 DEFAULT_FOLDER_NAMES = ["朋友圈", "生活分享", "每日記錄", "備份"]
 
-# 用於存儲待保存的訊息和自定義資料夾名稱
-pending_messages = {}
-user_folder_names = {}
+# 用於存儲待保存的訊息和自定義資料夾名稱（後端由 SESSION_STORE 設定）
+store = session_store
 
 async def handle_message(update):
     if "message" not in update:
@@ -41,17 +63,26 @@ async def handle_message(update):
             return
         
         elif text == "/save":
-            # 保存待處理的訊息
-            if chat_id in pending_messages and pending_messages[chat_id]:
-                folder_name = user_folder_names.get(chat_id, DEFAULT_FOLDER_NAMES[0])
+            # 先處理還在等待的相簿，再保存待處理的訊息
+            await album_buffer.flush(chat_id)
+            if await store.has_pending(chat_id):
+                folder_name = await store.get_folder(chat_id) or DEFAULT_FOLDER_NAMES[0]
                 await save_pending_messages(chat_id, folder_name)
             else:
                 await send_message(chat_id, "沒有待保存的訊息。請先轉發朋友圈內容。")
             return
         
+        elif text == "/list" or text.startswith("/list "):
+            await send_backup_list(chat_id, text[len("/list"):].strip())
+            return
+        
+        elif text == "/search" or text.startswith("/search "):
+            await send_search_results(chat_id, text[len("/search"):].strip())
+            return
+        
         # 檢查是否為預設資料夾名稱選擇
         if text in DEFAULT_FOLDER_NAMES:
-            user_folder_names[chat_id] = text
+            await store.set_folder(chat_id, text)
             await send_message(chat_id, f"✓ 已選擇資料夾：{text}\n\n現在請轉發朋友圈內容，完成後輸入 /save 保存。")
             return
         
@@ -60,7 +91,7 @@ async def handle_message(update):
             # 用戶輸入的自定義名稱
             custom_name = text[3:].strip()
             if custom_name:
-                user_folder_names[chat_id] = custom_name
+                await store.set_folder(chat_id, custom_name)
                 await send_message(chat_id, f"✓ 已設定資料夾名稱：{custom_name}\n\n現在請轉發朋友圈內容，完成後輸入 /save 保存。")
                 return
         
@@ -68,75 +99,99 @@ async def handle_message(update):
         # 用戶可以直接輸入任何文字作為資料夾名稱
         if not text.startswith("/"):
             # 檢查是否在等待自定義資料夾名稱
-            if chat_id not in user_folder_names or user_folder_names[chat_id] is None:
+            if await store.get_folder(chat_id) is None:
                 # 假設用戶想要設定自定義資料夾名稱
-                user_folder_names[chat_id] = text
+                await store.set_folder(chat_id, text)
                 await send_message(chat_id, f"✓ 已設定資料夾名稱：{text}\n\n現在請轉發朋友圈內容，完成後輸入 /save 保存。")
                 return
             
             # 否則作為普通文字訊息處理
-            if chat_id not in pending_messages:
-                pending_messages[chat_id] = {
-                    'texts': [],
-                    'photos': [],
-                    'videos': [],
-                    'message_id': message_id
-                }
-            
-            pending_messages[chat_id]['texts'].append(text)
+            await store.add_item(chat_id, 'texts', text, message_id)
             await send_message(chat_id, f"✓ 已記錄文字訊息")
             return
 
     # 初始化待保存訊息
-    if chat_id not in pending_messages:
-        pending_messages[chat_id] = {
-            'texts': [],
-            'photos': [],
-            'videos': [],
-            'message_id': message_id
-        }
+    await store.start_pending(chat_id, message_id)
     
     # 如果用戶還沒選擇資料夾名稱，提示選擇
-    if chat_id not in user_folder_names or user_folder_names[chat_id] is None:
+    if await store.get_folder(chat_id) is None:
         await send_folder_selection_message(chat_id)
         return
 
-    # 處理圖片
+    # 相簿中的媒體先收集起來，之後一起取得檔案路徑並只回覆一次
+    if message.get("media_group_id") and _extract_media(message):
+        album_buffer.add(chat_id, message["media_group_id"], message)
+        return
+    
+    added, totals, too_large = await record_media(chat_id, [message])
+    if 'photos' in added:
+        await send_message(chat_id, f"✓ 已記錄圖片 ({totals['photos']} 張)")
+    if too_large:
+        await send_message(chat_id, f"❌ 影片檔案超過 {VIDEO_MAX_SIZE_MB}MB 限制，無法保存")
+    if 'videos' in added:
+        await send_message(chat_id, f"✓ 已記錄影片 ({totals['videos']} 個)")
+
+def _extract_media(message):
+    """取出訊息中的圖片（最高畫質）與影片，回傳 [(種類, 媒體資訊)]"""
+    media = []
     if "photo" in message:
-        photo = message["photo"][-1]  # 取得最高畫質
-        file_id = photo["file_id"]
-        file_path = await get_file_path(file_id)
-        if file_path:
-            pending_messages[chat_id]['photos'].append({
-                'file_id': file_id,
-                'file_path': file_path,
-                'caption': message.get("caption", "")
-            })
-            await send_message(chat_id, f"✓ 已記錄圖片 ({len(pending_messages[chat_id]['photos'])} 張)")
-
-    # 處理影片
+        media.append(('photos', message["photo"][-1]))
     if "video" in message:
-        video = message["video"]
-        file_id = video["file_id"]
-        file_size = video.get("file_size", 0)
-        
-        # 檢查檔案大小
-        if file_size > 50 * 1024 * 1024:
-            await send_message(chat_id, "❌ 影片檔案超過 50MB 限制，無法保存")
-            return
-        
-        file_path = await get_file_path(file_id)
-        if file_path:
-            pending_messages[chat_id]['videos'].append({
-                'file_id': file_id,
-                'file_path': file_path,
-                'caption': message.get("caption", "")
-            })
-            await send_message(chat_id, f"✓ 已記錄影片 ({len(pending_messages[chat_id]['videos'])} 個)")
+        media.append(('videos', message["video"]))
+    return media
+
+async def record_media(chat_id, messages):
+    """並行取得訊息中所有媒體的檔案路徑並加入待保存訊息
+
+    回傳 (各種類新增數量, 各種類待保存總數, 超過大小限制的影片數量)。
+    """
+    jobs = []
+    too_large = 0
+    for message in messages:
+        for kind, media in _extract_media(message):
+            # 檢查檔案大小
+            if kind == 'videos' and media.get("file_size", 0) > VIDEO_MAX_SIZE:
+                too_large += 1
+                continue
+            jobs.append((message, kind, media))
+    
+    file_paths = await asyncio.gather(*(get_file_path(media["file_id"]) for _, _, media in jobs))
+    
+    added = {}
+    totals = {}
+    for (message, kind, media), file_path in zip(jobs, file_paths):
+        if not file_path:
+            continue
+        start_prefetch(media.get("file_unique_id"), file_path, max_size=VIDEO_MAX_SIZE if kind == 'videos' else None)
+        totals[kind] = await store.add_item(chat_id, kind, {
+            'file_id': media["file_id"],
+            'file_unique_id': media.get("file_unique_id"),
+            'file_path': file_path,
+            'caption': message.get("caption", "")
+        }, message["message_id"])
+        added[kind] = added.get(kind, 0) + 1
+    return added, totals, too_large
+
+async def record_album(chat_id, messages):
+    """記錄整個相簿的媒體，並以一則訊息回覆"""
+    added, totals, too_large = await record_media(chat_id, messages)
+    
+    labels = (('photos', '圖片', '張'), ('videos', '影片', '個'))
+    if added:
+        response = "✓ 已記錄相簿：" + "、".join(f"{label} {added[kind]} {unit}" for kind, label, unit in labels if kind in added)
+        response += "\n待保存：" + "、".join(f"{label} {totals[kind]} {unit}" for kind, label, unit in labels if kind in totals)
+    else:
+        response = "❌ 無法取得相簿中的媒體"
+    if too_large:
+        response += f"\n❌ {too_large} 個影片超過 {VIDEO_MAX_SIZE_MB}MB 限制，無法保存"
+    
+    await send_message(chat_id, response)
+
+album_buffer = AlbumBuffer(record_album)
 
 async def send_start_message(chat_id):
     """發送開始訊息"""
-    message_text = """👋 歡迎使用朋友圈備份機器人！
+    message_text = f"""👋 歡迎使用朋友圈備份機器人！
 
 📋 使用步驟：
 1️⃣ 輸入 /setfolder 選擇或自定義資料夾名稱
@@ -144,7 +199,7 @@ async def send_start_message(chat_id):
 3️⃣ 完成後輸入 /save 保存到 Google Drive
 
 💡 提示：
-- 支援的媒體類型：文字、圖片、影片 (MP4, MOV, 最大 50MB)
+- 支援的媒體類型：文字、圖片、影片 (MP4, MOV, 最大 {VIDEO_MAX_SIZE_MB}MB)
 - 文字訊息會保存為 Google Docs
 - 每條文字訊息建立獨立的 Doc 檔案
 - Doc 檔案中會嵌入相關的圖片和影片連結
@@ -153,7 +208,9 @@ async def send_start_message(chat_id):
 🔧 指令：
 /start - 顯示此訊息
 /setfolder - 選擇或自定義資料夾名稱
-/save - 保存待處理的訊息"""
+/save - 保存待處理的訊息
+/list [日期] - 列出某日備份的內容（預設今天，格式 2026-10-01）
+/search 關鍵字 - 搜尋已備份的文字與說明"""
     
     await send_message(chat_id, message_text)
 
@@ -170,92 +227,284 @@ async def send_folder_selection_message(chat_id):
     
     await send_message(chat_id, message_text)
 
+# Telegram 單則訊息的長度上限
+MAX_MESSAGE_LENGTH = 4096
+
+KIND_LABELS = {'text': '文字', 'doc': '文件', 'photo': '圖片', 'video': '影片', 'archive': '封存檔'}
+
+def _truncate_lines(header, lines):
+    """組合訊息並在超過 Telegram 長度上限時截斷"""
+    message_text = header
+    for i, line in enumerate(lines):
+        if len(message_text) + len(line) + 1 > MAX_MESSAGE_LENGTH - 50:
+            message_text += f"…還有 {len(lines) - i} 項未顯示"
+            break
+        message_text += line + "\n"
+    return message_text
+
+async def send_backup_list(chat_id, date_str):
+    """從本地索引列出某日備份的內容"""
+    date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        await send_message(chat_id, "日期格式錯誤，請使用 YYYY-MM-DD，例如：/list 2026-10-01")
+        return
+    
+    files = await catalog.list_files(date_str, chat_id=chat_id)
+    if not files:
+        await send_message(chat_id, f"📅 {date_str} 沒有備份記錄。")
+        return
+    
+    # 依資料夾與訊息分組
+    groups = {}
+    for file in files:
+        groups.setdefault((file['folder_name'], file['message_id']), []).append(file)
+    
+    lines = []
+    for (folder_name, message_id), group in groups.items():
+        lines.append(f"\n📁 {folder_name} / message_{message_id}")
+        for file in group:
+            lines.append(f"• {KIND_LABELS.get(file['kind'], file['kind'])}: {file['web_link']}")
+    
+    await send_message(chat_id, _truncate_lines(f"📅 {date_str} 共備份 {len(files)} 個檔案\n", lines))
+
+async def send_search_results(chat_id, query):
+    """從本地索引搜尋已備份的文字與說明"""
+    if not query:
+        await send_message(chat_id, "請輸入關鍵字，例如：/search 生日")
+        return
+    
+    results = await catalog.search(query, chat_id=chat_id)
+    if not results:
+        await send_message(chat_id, f"🔍 找不到包含「{query}」的備份。")
+        return
+    
+    lines = []
+    for file in results:
+        caption = " ".join(file['caption'].split())
+        if len(caption) > 60:
+            caption = caption[:60] + "…"
+        lines.append(f"\n📅 {file['date']} 📁 {file['folder_name']} ({KIND_LABELS.get(file['kind'], file['kind'])})")
+        lines.append(caption)
+        lines.append(file['web_link'] or "")
+    
+    await send_message(chat_id, _truncate_lines(f"🔍 「{query}」找到 {len(results)} 筆結果\n", lines))
+
+class SaveProgress:
+    """以同一則訊息顯示保存進度，更新太頻繁時由 outbox 合併"""
+
+    def __init__(self, chat_id, total):
+        self.chat_id = chat_id
+        self.total = total
+        self.done = 0
+        outbox.progress(chat_id, 'save', self._text())
+
+    def _text(self):
+        return f"⏳ 正在保存訊息，請稍候... ({self.done}/{self.total})"
+
+    async def track(self, job):
+        """等待上傳工作完成並更新進度"""
+        try:
+            return await job
+        finally:
+            self.done += 1
+            outbox.progress(self.chat_id, 'save', self._text())
+
+    def finish(self):
+        outbox.end_progress(self.chat_id, 'save')
+
 async def save_pending_messages(chat_id, folder_name):
     """保存待處理的訊息到 Google Drive"""
-    if chat_id not in pending_messages or not pending_messages[chat_id]:
+    pending = await store.get_pending(chat_id)
+    if not pending:
         await send_message(chat_id, "沒有待保存的訊息。")
         return
     
-    pending = pending_messages[chat_id]
     message_id = pending['message_id']
+    date_str = datetime.now().strftime('%Y-%m-%d')
     
-    await send_message(chat_id, "⏳ 正在保存訊息，請稍候...")
+    media_count = len(pending['photos']) + len(pending['videos'])
+    archive_mode = is_archive_folder(folder_name)
+    if archive_mode:
+        total = 1
+    elif DOC_MODE == "post":
+        total = media_count + (1 if pending['texts'] or media_count else 0)
+    else:
+        total = media_count + len(pending['texts'])
+    progress = SaveProgress(chat_id, total)
     
-    saved_count = 0
-    errors = []
+    # 讓上傳函數記錄檔案來源的對話
+    token = current_chat_id.set(chat_id)
+    try:
+        with trace_save(chat_id):
+            if archive_mode:
+                saved_count, errors, failed = await save_as_archive(pending, message_id, folder_name, progress)
+            elif DOC_MODE == "post":
+                saved_count, errors, failed = await save_as_post_document(pending, message_id, folder_name, progress)
+            else:
+                saved_count, errors, failed = await save_as_text_documents(pending, message_id, folder_name, progress)
+    finally:
+        current_chat_id.reset(token)
+        progress.finish()
+    save_files.inc(saved_count, result="saved")
+    save_files.inc(len(errors), result="failed")
+    
+    # 更新當日報告（延遲合併寫入 Drive）
+    schedule_report_update(folder_name, date_str)
+    
+    # 發送結果訊息
+    response = f"✅ 已保存 {saved_count} 個檔案\n"
+    response += f"📅 日期：{date_str}\n"
+    response += f"📁 資料夾：{folder_name}\n"
+    response += f"📍 訊息已按日期和訊息 ID 分類\n"
+    
+    if errors:
+        response += "\n⚠️ 發生以下錯誤：\n"
+        for error in errors:
+            response += f"- {error}\n"
+    
+    # 只清除已保存的項目，保存失敗的項目留待下次 /save 重試（使用同一個訊息資料夾）
+    failed['message_id'] = message_id
+    await store.replace_pending(chat_id, failed)
+    unsaved = sum(len(failed[kind]) for kind in ('texts', 'photos', 'videos'))
+    if unsaved:
+        response += f"\n🔁 {unsaved} 個未保存的項目已保留，請稍後再次輸入 /save 重試。\n"
+    
+    await send_message(chat_id, response)
+
+async def save_as_text_documents(pending, message_id, folder_name, progress):
+    """每條文字建立獨立的 Google Doc，並逐一上傳媒體，回傳 (保存數量, 錯誤清單, 保存失敗的項目)"""
+    # 準備媒體連結
+    media_links = []
+    
+    # 添加圖片連結
+    for i, photo in enumerate(pending['photos'], 1):
+        media_links.append(('圖片', photo.get('file_path', 'N/A')))
+    
+    # 添加影片連結
+    for i, video in enumerate(pending['videos'], 1):
+        media_links.append(('影片', video.get('file_path', 'N/A')))
+    
+    # 建立所有上傳工作，下載與上傳的並行數量由 gdrive 中的上限控制
+    jobs = []
     
     # 保存文字（使用 Google Docs）
     for text in pending['texts']:
-        try:
-            # 準備媒體連結
-            media_links = []
-            
-            # 添加圖片連結
-            for i, photo in enumerate(pending['photos'], 1):
-                media_links.append(('圖片', photo.get('file_path', 'N/A')))
-            
-            # 添加影片連結
-            for i, video in enumerate(pending['videos'], 1):
-                media_links.append(('影片', video.get('file_path', 'N/A')))
-            
-            result = await create_google_doc(text, message_id, folder_name, media_links if media_links else None)
-            if result:
-                saved_count += 1
-        except Exception as e:
-            errors.append(f"文字保存失敗: {str(e)}")
+        jobs.append(("文字", 'texts', text, create_google_doc(text, message_id, folder_name, media_links if media_links else None)))
     
     # 保存圖片
     for photo in pending['photos']:
-        try:
-            image_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{photo['file_path']}"
-            result = await upload_photo(image_url, message_id, folder_name, photo.get('caption', ''))
-            if result:
-                saved_count += 1
-        except Exception as e:
-            errors.append(f"圖片保存失敗: {str(e)}")
+        image_url = get_file_url(photo['file_path'])
+        jobs.append(("圖片", 'photos', photo, upload_media('photo', image_url, message_id, folder_name, photo.get('caption', ''), photo.get('file_unique_id'))))
     
     # 保存影片
     for video in pending['videos']:
+        video_url = get_file_url(video['file_path'])
+        jobs.append(("影片", 'videos', video, upload_media('video', video_url, message_id, folder_name, video.get('caption', ''), video.get('file_unique_id'))))
+    
+    results = await asyncio.gather(*(progress.track(job) for _, _, _, job in jobs), return_exceptions=True)
+    
+    saved_count = 0
+    errors = []
+    failed = {'texts': [], 'photos': [], 'videos': []}
+    for (label, kind, item, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            errors.append(f"{label}保存失敗: {str(result)}")
+        elif not result:
+            errors.append(f"{label}保存失敗: Google Drive 未設定")
+        else:
+            saved_count += 1
+            continue
+        failed[kind].append(item)
+    
+    return saved_count, errors, failed
+
+async def save_as_post_document(pending, message_id, folder_name, progress):
+    """先並行上傳所有媒體，再將所有文字與媒體的 Drive 連結寫入同一份 Google Doc"""
+    media = [('photo', '圖片', photo) for photo in pending['photos']]
+    media += [('video', '影片', video) for video in pending['videos']]
+    
+    results = await asyncio.gather(*(
+        progress.track(upload_media(kind, get_file_url(item['file_path']), message_id, folder_name,
+                                    item.get('caption', ''), item.get('file_unique_id')))
+        for kind, _, item in media
+    ), return_exceptions=True)
+    
+    saved_count = 0
+    errors = []
+    failed = {'texts': [], 'photos': [], 'videos': []}
+    media_items = []
+    for (kind, label, item), result in zip(media, results):
+        if isinstance(result, Exception):
+            errors.append(f"{label}保存失敗: {str(result)}")
+        elif not result:
+            errors.append(f"{label}保存失敗: Google Drive 未設定")
+        else:
+            saved_count += 1
+            media_items.append({'kind': kind, 'file': result, 'caption': item.get('caption', '')})
+            continue
+        failed[kind + 's'].append(item)
+    
+    if pending['texts'] or media_items:
         try:
-            video_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{video['file_path']}"
-            result = await upload_video(video_url, message_id, folder_name, video.get('caption', ''))
-            if result:
+            if await progress.track(create_post_document(pending['texts'], media_items, message_id, folder_name)):
                 saved_count += 1
+            else:
+                errors.append("文字保存失敗: Google Docs 未設定")
+                failed['texts'] = list(pending['texts'])
         except Exception as e:
-            errors.append(f"影片保存失敗: {str(e)}")
-    
-    # 發送結果訊息
-    response = f"✅ 已保存 {saved_count} 個檔案\n"
-    response += f"📅 日期：{datetime.now().strftime('%Y-%m-%d')}\n"
-    response += f"📁 資料夾：{folder_name}\n"
-    response += f"📍 訊息已按日期和訊息 ID 分類\n"
+            errors.append(f"文字保存失敗: {str(e)}")
+            failed['texts'] = list(pending['texts'])
     
-    if errors:
-        response += "\n⚠️ 發生以下錯誤：\n"
-        for error in errors:
-            response += f"- {error}\n"
+    return saved_count, errors, failed
+
+async def save_as_archive(pending, message_id, folder_name, progress):
+    """將所有文字與媒體打包成一個 ZIP 上傳，回傳的保存數量為封存檔中的項目數"""
+    media = [('photo', get_file_url(photo['file_path']), photo.get('caption', ''), photo.get('file_unique_id'))
+             for photo in pending['photos']]
+    media += [('video', get_file_url(video['file_path']), video.get('caption', ''), video.get('file_unique_id'))
+              for video in pending['videos']]
     
-    await send_message(chat_id, response)
+    # 封存檔未建立時所有項目都保留；已建立時只保留下載失敗的媒體
+    all_items = {kind: list(pending[kind]) for kind in ('texts', 'photos', 'videos')}
+    try:
+        file, saved_count, errors, failed_indexes = await progress.track(upload_archive(pending['texts'], media, message_id, folder_name))
+    except Exception as e:
+        return 0, [f"封存檔保存失敗: {str(e)}"], all_items
+    if not file:
+        return 0, errors or ["封存檔保存失敗"], all_items
     
-    # 清除待處理訊息
-    pending_messages[chat_id] = None
+    items = pending['photos'] + pending['videos']
+    failed = {'texts': [], 'photos': [], 'videos': []}
+    for index in failed_indexes:
+        failed['photos' if index < len(pending['photos']) else 'videos'].append(items[index])
+    return saved_count, errors, failed
+
+def get_file_url(file_path):
+    """取得 Telegram 檔案的下載網址；本地 Bot API 伺服器回傳磁碟上的路徑，以 ('local', 路徑) 直接讀取"""
+    if TELEGRAM_LOCAL_MODE:
+        return local_file_source(file_path)
+    return f"{TELEGRAM_API_BASE}/file/bot{BOT_TOKEN}/{file_path}"
+
+def start_prefetch(file_unique_id, file_path, max_size=None):
+    """啟用預先下載時，在背景開始下載媒體到本地暫存區"""
+    if prefetch_spool and file_unique_id:
+        prefetch_spool.start(file_unique_id, get_file_url(file_path), max_size=max_size)
 
 async def get_file_path(file_id):
     """取得 Telegram 檔案路徑"""
-    async with httpx.AsyncClient() as client:
-        try:
+    client = get_client()
+    try:
+        with observe("telegram.getFile"):
             response = await client.get(f"{TELEGRAM_API_URL}/getFile", params={"file_id": file_id})
-            data = response.json()
-            if data["ok"]:
-                return data["result"]["file_path"]
-        except Exception as e:
-            print(f"Error getting file path: {e}")
+        data = response.json()
+        if data["ok"]:
+            return data["result"]["file_path"]
+    except Exception as e:
+        print(f"Error getting file path: {e}")
     return None
 
 async def send_message(chat_id, text):
-    """發送訊息給使用者"""
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.post(f"{TELEGRAM_API_URL}/sendMessage", json={"chat_id": chat_id, "text": text})
-        except Exception as e:
-            print(f"Error sending message: {e}")
+    """發送訊息給使用者（經由 outbox 依速率限制排隊發送）"""
+    outbox.send(chat_id, text)
@@ -0,0 +1,151 @@
+# catalog.py
+
+import os
+import time
+import sqlite3
+import contextvars
+from datetime import datetime
+
+from storage import DATA_DIR, AsyncDatabase
+
+# 所有已備份檔案的本地索引，/list、/search 與每日報告直接查詢索引，不需要呼叫 Drive
+CATALOG_DB_PATH = os.environ.get("CATALOG_DB_PATH", os.path.join(DATA_DIR, "catalog.db"))
+
+# 目前正在保存的對話，由 bot 在 /save 時設定，上傳函數據此記錄來源
+current_chat_id = contextvars.ContextVar("current_chat_id", default=None)
+
+# trigram 分詞可搜尋沒有空格分隔的中文，但查詢至少需要 3 個字元
+FTS_MIN_QUERY_LENGTH = 3
+
+def _create_tables(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER,
+            folder_name TEXT NOT NULL,
+            date TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            drive_file_id TEXT NOT NULL,
+            web_link TEXT,
+            size INTEGER,
+            content_hash TEXT,
+            caption TEXT,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS files_folder_date ON files (folder_name, date, message_id);
+        CREATE INDEX IF NOT EXISTS files_chat_date ON files (chat_id, date);
+    """)
+    fts = _create_fts(conn)
+    conn.commit()
+    return fts
+
+def _create_fts(conn):
+    """建立 FTS5 全文索引；SQLite 不支援時改用 LIKE 搜尋"""
+    try:
+        conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+                caption, content='files', content_rowid='id', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+                INSERT INTO files_fts (rowid, caption) VALUES (new.id, new.caption);
+            END;
+            CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+            END;
+        """)
+        return True
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 unavailable, falling back to LIKE search: {e}")
+        return False
+
+def _rows(cursor):
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def _insert_file(conn, values):
+    conn.execute(
+        "INSERT INTO files (chat_id, folder_name, date, message_id, kind, drive_file_id, web_link, size, content_hash, caption, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        values
+    )
+    conn.commit()
+
+def _query(conn, query, params):
+    return _rows(conn.execute(query, params))
+
+def _folders(conn, date_str):
+    rows = conn.execute("SELECT DISTINCT folder_name FROM files WHERE date = ?", (date_str,)).fetchall()
+    return [row[0] for row in rows]
+
+class BackupCatalog:
+    """記錄每個上傳到 Drive 的檔案（來源對話、資料夾、日期、訊息、連結、大小、雜湊與說明文字）
+
+    資料庫操作在專用執行緒中執行，等待其他行程的寫入鎖時不會阻塞事件迴圈。
+    """
+
+    def __init__(self, path=CATALOG_DB_PATH):
+        self.db = AsyncDatabase(path, name="catalog")
+        self.fts = self.db.run_sync(_create_tables)
+
+    async def record(self, folder_name, message_id, kind, file, size=None, content_hash=None, caption="", chat_id=None, date_str=None):
+        """記錄一個已上傳的檔案，file 為 Drive 回傳的 {'id', 'webViewLink'}"""
+        if chat_id is None:
+            chat_id = current_chat_id.get()
+        await self.db.run(_insert_file, (
+            chat_id, folder_name, date_str or datetime.now().strftime("%Y-%m-%d"), message_id, kind,
+            file['id'], file.get('webViewLink'), size, content_hash, caption or "", time.time()
+        ))
+
+    async def list_files(self, date_str, chat_id=None, folder_name=None):
+        """列出某日備份的檔案，可依對話或資料夾篩選"""
+        query = "SELECT * FROM files WHERE date = ?"
+        params = [date_str]
+        if chat_id is not None:
+            query += " AND chat_id = ?"
+            params.append(chat_id)
+        if folder_name is not None:
+            query += " AND folder_name = ?"
+            params.append(folder_name)
+        return await self.db.run(_query, query + " ORDER BY created_at", params)
+
+    async def message_entries(self, folder_name, date_str):
+        """依訊息彙總某資料夾某日的備份，回傳各訊息的首次保存時間與各類檔案數量"""
+        return await self.db.run(
+            _query,
+            "SELECT message_id, MIN(created_at) AS saved_at, "
+            "SUM(kind = 'text') AS texts, SUM(kind = 'doc') AS docs, "
+            "SUM(kind = 'photo') AS photos, SUM(kind = 'video') AS videos, SUM(kind = 'archive') AS archives, "
+            "COUNT(*) AS saved_count "
+            "FROM files WHERE folder_name = ? AND date = ? GROUP BY message_id ORDER BY saved_at",
+            (folder_name, date_str)
+        )
+
+    async def folders(self, date_str):
+        """某日有備份的資料夾名稱"""
+        return await self.db.run(_folders, date_str)
+
+    async def search(self, text, chat_id=None, limit=20):
+        """搜尋說明與文字內容，依時間由新到舊回傳"""
+        text = text.strip()
+        if not text:
+            return []
+        if self.fts and len(text) >= FTS_MIN_QUERY_LENGTH:
+            phrase = '"' + text.replace('"', '""') + '"'
+            query = "SELECT files.* FROM files_fts JOIN files ON files.id = files_fts.rowid WHERE files_fts MATCH ?"
+            params = [phrase]
+        else:
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = "SELECT * FROM files WHERE caption LIKE ? ESCAPE '\\'"
+            params = [f"%{escaped}%"]
+        if chat_id is not None:
+            query += " AND files.chat_id = ?"
+            params.append(chat_id)
+        query += " ORDER BY files.created_at DESC LIMIT ?"
+        params.append(limit)
+        return await self.db.run(_query, query, params)
+
+    def close(self):
+        self.db.close()
+
+catalog = BackupCatalog()
@@ -0,0 +1,113 @@
+# dedupe.py
+
+import os
+import time
+
+from storage import DATA_DIR, AsyncDatabase
+
+# 重複媒體處理方式：off 停用、skip 直接略過、shortcut 在訊息資料夾建立指向既有檔案的捷徑
+DEDUPE_MODE = os.environ.get("DEDUPE_MODE", "shortcut").lower()
+DEDUPE_DB_PATH = os.environ.get("DEDUPE_DB_PATH", os.path.join(DATA_DIR, "dedupe.db"))
+
+def _create_tables(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS media (
+            file_unique_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            drive_file_id TEXT NOT NULL,
+            web_link TEXT,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS media_hash ON media (content_hash);
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """)
+    conn.commit()
+
+def _row(row):
+    if row is None:
+        return None
+    return {'drive_file_id': row[0], 'web_link': row[1], 'size': row[2], 'content_hash': row[3]}
+
+def _find_by_unique_id(conn, file_unique_id):
+    return _row(conn.execute(
+        "SELECT drive_file_id, web_link, size, content_hash FROM media WHERE file_unique_id = ?",
+        (file_unique_id,)
+    ).fetchone())
+
+def _find_by_hash(conn, content_hash):
+    return _row(conn.execute(
+        "SELECT drive_file_id, web_link, size, content_hash FROM media WHERE content_hash = ? LIMIT 1",
+        (content_hash,)
+    ).fetchone())
+
+def _record(conn, file_unique_id, content_hash, drive_file_id, web_link, size):
+    conn.execute(
+        "INSERT OR REPLACE INTO media (file_unique_id, content_hash, drive_file_id, web_link, size, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (file_unique_id or f"sha256:{content_hash}", content_hash, drive_file_id, web_link, size, time.time())
+    )
+    conn.commit()
+
+def _forget(conn, drive_file_id):
+    conn.execute("DELETE FROM media WHERE drive_file_id = ?", (drive_file_id,))
+    conn.commit()
+
+def _count_duplicate(conn, bytes_saved):
+    conn.executemany(
+        "INSERT INTO stats (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        [('duplicates_skipped', 1), ('bytes_saved', bytes_saved)]
+    )
+    conn.commit()
+
+def _load_stats(conn):
+    stats = {'duplicates_skipped': 0, 'bytes_saved': 0}
+    stats.update(conn.execute("SELECT name, value FROM stats").fetchall())
+    return stats
+
+class DedupeIndex:
+    """以 Telegram file_unique_id 與內容雜湊記錄已上傳媒體的本地索引
+
+    資料庫操作在專用執行緒中執行，等待其他行程的寫入鎖時不會阻塞事件迴圈。
+    """
+
+    def __init__(self, path=DEDUPE_DB_PATH):
+        self.db = AsyncDatabase(path, name="dedupe")
+        self.db.run_sync(_create_tables)
+        # 統計數據在啟動時讀取，之後由本行程累加，匯出指標時不需查詢資料庫
+        self._stats = self.db.run_sync(_load_stats)
+
+    async def find_by_unique_id(self, file_unique_id):
+        """以 file_unique_id 查詢已上傳的檔案"""
+        return await self.db.run(_find_by_unique_id, file_unique_id)
+
+    async def find_by_hash(self, content_hash):
+        """以內容雜湊查詢已上傳的檔案"""
+        return await self.db.run(_find_by_hash, content_hash)
+
+    async def record(self, file_unique_id, content_hash, drive_file_id, web_link, size):
+        """記錄已上傳的檔案"""
+        await self.db.run(_record, file_unique_id, content_hash, drive_file_id, web_link, size)
+
+    async def forget(self, drive_file_id):
+        """移除已不存在於 Drive 的檔案記錄"""
+        await self.db.run(_forget, drive_file_id)
+
+    async def count_duplicate(self, bytes_saved):
+        """累計略過的重複檔案數量與節省的傳輸量"""
+        self._stats['duplicates_skipped'] += 1
+        self._stats['bytes_saved'] += bytes_saved
+        await self.db.run(_count_duplicate, bytes_saved)
+
+    def stats(self):
+        """回傳 {'duplicates_skipped', 'bytes_saved'} 統計數據"""
+        return dict(self._stats)
+
+    def close(self):
+        self.db.close()
+
+dedupe_index = DedupeIndex() if DEDUPE_MODE != "off" else None
@@ -0,0 +1,140 @@
+# drive_async.py
+
+import os
+import re
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+import google_auth_httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+
+from rate_limit import rate_limiter, backoff_delay, is_rate_limited, is_retryable
+from metrics import observe, google_api_retries
+
+# Google API 的同步呼叫在獨立的執行緒池中執行，避免阻塞 uvicorn 的事件迴圈
+DRIVE_MAX_WORKERS = int(os.environ.get("DRIVE_MAX_WORKERS", 8))
+# 同時進行中的 Google API 呼叫上限（包含排隊等待執行緒的呼叫）
+DRIVE_MAX_CONCURRENCY = int(os.environ.get("DRIVE_MAX_CONCURRENCY", DRIVE_MAX_WORKERS))
+
+_executor = ThreadPoolExecutor(max_workers=DRIVE_MAX_WORKERS, thread_name_prefix="gdrive")
+_semaphore = asyncio.Semaphore(DRIVE_MAX_CONCURRENCY)
+
+# 非冪等操作：伺服器可能已處理請求但回應遺失，重試會產生重複的檔案或重複寫入文件內容
+NON_IDEMPOTENT_METHODS = ('drive.files.create', 'drive.files.copy', 'docs.documents.batchUpdate')
+# 其中建立檔案的請求可以預先指定 ID，重試時會得到 409 而不是重複建立
+PREASSIGNED_ID_METHODS = ('drive.files.create', 'drive.files.copy')
+_PREASSIGNED_ID = re.compile(r'"id":\s*"')
+
+# httplib2 不是執行緒安全的，每個執行緒使用自己的連線
+_thread_local = threading.local()
+
+def _thread_http(credentials):
+    """取得目前執行緒專用的已授權 HTTP 連線"""
+    http = getattr(_thread_local, "http", None)
+    if http is None or http.credentials is not credentials:
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+        _thread_local.http = http
+    return http
+
+def _execute_sync(request, credentials=None):
+    """在工作執行緒中執行 Google API 請求（含批次請求）"""
+    if credentials is None:
+        credentials = getattr(getattr(request, "http", None), "credentials", None)
+    if credentials is None:
+        return request.execute()
+    return request.execute(http=_thread_http(credentials))
+
+def _next_chunk_sync(request):
+    """在工作執行緒中上傳續傳請求的下一個區塊"""
+    credentials = getattr(request.http, "credentials", None)
+    if credentials is None:
+        return request.next_chunk()
+    return request.next_chunk(http=_thread_http(credentials))
+
+def safe_to_retry(request):
+    """伺服器可能已處理請求時是否可以重試；建立檔案的請求須預先指定 ID，重試時才會回傳 409 而不是重複建立"""
+    method_id = getattr(request, "methodId", None)
+    if method_id not in NON_IDEMPOTENT_METHODS:
+        return True
+    if method_id not in PREASSIGNED_ID_METHODS:
+        return False
+    body = request.body or ''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    return _PREASSIGNED_ID.search(body) is not None
+
+async def run_in_executor(func, *args):
+    """在 Google API 執行緒池中執行任意同步函數"""
+    loop = asyncio.get_running_loop()
+    async with _semaphore:
+        return await loop.run_in_executor(_executor, func, *args)
+
+async def execute(request, credentials=None, kind=None, cost=1):
+    """以非阻塞方式執行 googleapiclient 的請求並回傳結果
+
+    請求會先經過該類別（read、write、docs）的速率限制；遇到限流、5xx 或連線錯誤時，
+    在重試預算內以指數退避重試。非冪等的請求（未指定 ID 的建立請求、文件的 batchUpdate）
+    只在被限流（請求未被處理）時重試。
+    """
+    kind = kind or rate_limiter.classify(request)
+    bucket = rate_limiter.buckets[kind]
+    budget = rate_limiter.budgets[kind]
+    retry_safe = safe_to_retry(request)
+
+    # 例如 drive.files.list、drive.files.create；批次請求沒有 methodId
+    operation = getattr(request, "methodId", None) or "google.batch"
+
+    attempt = 0
+    while True:
+        with observe(f"rate_limit_wait.{kind}"):
+            await bucket.acquire(cost)
+        try:
+            with observe(operation):
+                result = await run_in_executor(_execute_sync, request, credentials)
+        except HttpError as e:
+            throttled = is_rate_limited(e)
+            if throttled:
+                bucket.on_throttle()
+            if not is_retryable(e) or not (retry_safe or throttled) or not budget.try_retry(attempt):
+                raise
+            google_api_retries.inc(kind=kind)
+            print(f"Retrying Google API {kind} request after HTTP {e.resp.status} (attempt {attempt + 1})")
+        except (OSError, httplib2.HttpLib2Error) as e:
+            if not retry_safe or not budget.try_retry(attempt):
+                raise
+            google_api_retries.inc(kind=kind)
+            print(f"Retrying Google API {kind} request after {e!r} (attempt {attempt + 1})")
+        else:
+            bucket.on_success()
+            budget.on_success()
+            return result
+
+        await asyncio.sleep(backoff_delay(attempt))
+        attempt += 1
+
+async def next_chunk(request):
+    """以非阻塞方式上傳續傳請求的下一個區塊，回傳 (status, response)
+
+    建立續傳工作階段的請求計入 Drive 寫入的速率限制。
+    """
+    bucket = rate_limiter.buckets['write']
+    if request.resumable_uri is None:
+        with observe("rate_limit_wait.write"):
+            await bucket.acquire()
+    try:
+        with observe("drive.upload_chunk"):
+            result = await run_in_executor(_next_chunk_sync, request)
+    except HttpError as e:
+        if is_rate_limited(e):
+            bucket.on_throttle()
+        raise
+    if request.resumable_uri is not None and result[1] is not None:
+        bucket.on_success()
+    return result
+
+def shutdown():
+    """關閉執行緒池"""
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+# drive_batch.py
+
+import os
+import asyncio
+
+from googleapiclient.errors import HttpError
+
+from drive_async import execute as drive_execute, safe_to_retry
+from rate_limit import is_retryable
+
+# Google 批次端點每次最多接受 100 個請求
+MAX_BATCH_SIZE = 100
+# 第一個請求送出後等待其他請求加入同一批次的秒數，0 為不合併
+DRIVE_BATCH_WINDOW = float(os.environ.get("DRIVE_BATCH_WINDOW", 0.01))
+
+class DriveBatcher:
+    """將同時送出的 Drive 中繼資料請求（查詢、建立資料夾或文件、捷徑）合併為一次批次請求
+
+    第一個請求送出後等待 window 秒，期間其他協程送出的請求（最多 100 個）以單一 HTTP 請求送到批次端點。
+    批次中的請求執行順序不固定，因此只能用於彼此獨立的請求；例如子資料夾須等父資料夾建立後才送出。
+    只有一個請求時直接執行；批次中可重試的失敗請求、或批次本身失敗時的所有請求，改為逐一執行。
+    """
+
+    def __init__(self, service, window=DRIVE_BATCH_WINDOW, max_size=MAX_BATCH_SIZE):
+        self.service = service
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    async def execute(self, request):
+        """執行請求並回傳結果，與其他同時送出的請求合併為一次批次"""
+        # 非冪等的請求不放入批次：批次失敗時會整批重試
+        if self.service is None or self.window <= 0 or not safe_to_retry(request):
+            return await drive_execute(request)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        """送出目前收集的請求"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        entries, self._pending = self._pending, []
+        if not entries:
+            return
+        task = asyncio.create_task(self._run(entries))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, entries):
+        results = await self._execute_batch([request for request, _ in entries]) if len(entries) > 1 else {}
+
+        async def resolve(i, request, future):
+            result = results.get(i)
+            # 批次中失敗或未回應的請求逐一執行；無法重試的錯誤（例如 404、409）直接交給呼叫端
+            if i not in results or (isinstance(result, HttpError) and is_retryable(result)):
+                try:
+                    result = await drive_execute(request)
+                except Exception as e:
+                    result = e
+            if future.done():
+                return
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+        await asyncio.gather(*(resolve(i, request, future) for i, (request, future) in enumerate(entries)))
+
+    async def _execute_batch(self, requests):
+        """以一次批次請求執行，回傳 {位置: 結果或例外}"""
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[int(request_id)] = exception if exception is not None else response
+
+        kind = 'read' if all(getattr(request, "method", None) == "GET" for request in requests) else 'write'
+        credentials = getattr(requests[0].http, "credentials", None)
+        try:
+            batch = self.service.new_batch_http_request(callback=callback)
+            for i, request in enumerate(requests):
+                batch.add(request, request_id=str(i))
+            await drive_execute(batch, credentials, kind=kind, cost=len(requests))
+        except Exception as e:
+            print(f"Drive batch request failed, falling back to individual calls: {e}")
+            results = {}
+        return results
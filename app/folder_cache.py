@@ -0,0 +1,203 @@
+# folder_cache.py
+
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+
+from storage import DATA_DIR, AsyncDatabase
+from work_queue import MULTI_WORKER
+
+# 資料夾 ID 快取設定
+FOLDER_CACHE_SIZE = int(os.environ.get("FOLDER_CACHE_SIZE", 1024))
+FOLDER_CACHE_TTL = float(os.environ.get("FOLDER_CACHE_TTL", 3600))
+# 多個工作行程時，以共用的 SQLite 表格協調資料夾的查詢與建立
+SHARED_FOLDERS_DB_PATH = os.environ.get("SHARED_FOLDERS_DB_PATH", os.path.join(DATA_DIR, "folders.db"))
+# 建立資料夾的行程超過此秒數沒有完成時，其他行程可以接手
+FOLDER_CLAIM_TIMEOUT = float(os.environ.get("FOLDER_CLAIM_TIMEOUT", 60))
+FOLDER_CLAIM_POLL_INTERVAL = float(os.environ.get("FOLDER_CLAIM_POLL_INTERVAL", 0.2))
+
+class FolderCache:
+    """以 (parent_id, name) 為鍵的資料夾 ID 快取，支援 TTL 與 LRU 淘汰"""
+
+    def __init__(self, maxsize=FOLDER_CACHE_SIZE, ttl=FOLDER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, parent_id, name):
+        """取得快取中的資料夾 ID，過期或不存在時回傳 None"""
+        key = (parent_id, name)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        folder_id, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return folder_id
+
+    def set(self, parent_id, name, folder_id):
+        """寫入快取，超過容量時淘汰最久未使用的項目"""
+        key = (parent_id, name)
+        self._entries[key] = (folder_id, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, folder_id):
+        """移除指定資料夾及其所有子資料夾的快取（例如 Drive 回傳 404 時）"""
+        if shared_folders:
+            shared_folders.forget(folder_id)
+        stale = {folder_id}
+        while stale:
+            current = stale.pop()
+            for key, (cached_id, _) in list(self._entries.items()):
+                if cached_id == current or key[0] == current:
+                    del self._entries[key]
+                    if cached_id != current:
+                        stale.add(cached_id)
+
+    def clear(self):
+        """清除所有快取"""
+        self._entries.clear()
+
+    async def resolve(self, parent_id, name, loader):
+        """取得資料夾 ID；同一個鍵的並行查詢只會呼叫一次 loader"""
+        folder_id = self.get(parent_id, name)
+        if folder_id:
+            self.hits += 1
+            return folder_id
+
+        key = (parent_id, name)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            folder_id = await loader(parent_id, name)
+            if folder_id:
+                self.set(parent_id, name, folder_id)
+            future.set_result(folder_id)
+            return folder_id
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免沒有其他等待者時出現 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+def _create_folders_table(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS folders (
+            parent_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            folder_id TEXT,
+            owner TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (parent_id, name)
+        );
+        CREATE INDEX IF NOT EXISTS folders_folder_id ON folders (folder_id);
+    """)
+    # 自行控制交易，BEGIN IMMEDIATE 時取得寫入鎖
+    conn.isolation_level = None
+
+def _release_folder(conn, parent_id, name, owner):
+    conn.execute(
+        "DELETE FROM folders WHERE parent_id = ? AND name = ? AND owner = ? AND folder_id IS NULL",
+        (parent_id, name, owner)
+    )
+
+def _publish_folder(conn, parent_id, name, folder_id):
+    conn.execute(
+        "UPDATE folders SET folder_id = ?, updated_at = ? WHERE parent_id = ? AND name = ?",
+        (folder_id, time.time(), parent_id, name)
+    )
+
+def _forget_folder(conn, folder_id):
+    conn.execute("DELETE FROM folders WHERE folder_id = ? OR parent_id = ?", (folder_id, folder_id))
+
+def _claim_folder(conn, parent_id, name, owner, now, ttl, claim_timeout):
+    """回傳 ('found', 資料夾 ID)、('claimed', None) 或 ('busy', None)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT folder_id, owner, updated_at FROM folders WHERE parent_id = ? AND name = ?", (parent_id, name)
+        ).fetchone()
+        if row and row[0] and row[2] > now - ttl:
+            result = ('found', row[0])
+        elif row and not row[0] and row[2] > now - claim_timeout:
+            result = ('busy', None)
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO folders (parent_id, name, folder_id, owner, updated_at) VALUES (?, ?, NULL, ?, ?)",
+                (parent_id, name, owner, now)
+            )
+            result = ('claimed', None)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return result
+
+class SharedFolderIndex:
+    """多個工作行程共用的資料夾索引，以 (parent_id, name) 的資料列作為建立資料夾的鎖
+
+    取得鎖的行程查詢或建立資料夾後寫入 ID，其他行程等待並使用同一個 ID，
+    避免不同行程同時建立同名的資料夾。
+    """
+
+    def __init__(self, path=SHARED_FOLDERS_DB_PATH, ttl=FOLDER_CACHE_TTL, claim_timeout=FOLDER_CLAIM_TIMEOUT,
+                 poll_interval=FOLDER_CLAIM_POLL_INTERVAL):
+        self.ttl = ttl
+        self.claim_timeout = claim_timeout
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.db = AsyncDatabase(path, name="shared-folders")
+        self.db.run_sync(_create_folders_table)
+
+    async def resolve(self, parent_id, name, loader):
+        """取得資料夾 ID；沒有其他行程正在處理時取得鎖並呼叫 loader 查詢或建立資料夾"""
+        while True:
+            state, folder_id = await self.db.run(
+                _claim_folder, parent_id, name, self.owner, time.time(), self.ttl, self.claim_timeout
+            )
+            if state == 'found':
+                return folder_id
+            if state == 'busy':
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            try:
+                folder_id = await loader(parent_id, name)
+            except BaseException:
+                await asyncio.shield(self.db.run(_release_folder, parent_id, name, self.owner))
+                raise
+            if not folder_id:
+                await self.db.run(_release_folder, parent_id, name, self.owner)
+                return None
+            await self.db.run(_publish_folder, parent_id, name, folder_id)
+            return folder_id
+
+    def forget(self, folder_id):
+        """移除已失效的資料夾及其子資料夾的記錄（在背景執行）"""
+        self.db.submit(_forget_folder, folder_id)
+
+    def close(self):
+        self.db.close()
+
+shared_folders = SharedFolderIndex() if MULTI_WORKER else None
+folder_cache = FolderCache()
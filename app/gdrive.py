@@ -2,16 +2,40 @@
 
 import os
 import json
-import httpx
+import base64
+import asyncio
+import hashlib
 from datetime import datetime
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
 import io
 
+from drive_async import execute as drive_execute
+from drive_batch import DriveBatcher
+from folder_cache import folder_cache, shared_folders
+from transfer import download_to_spool, media_upload
+from dedupe import dedupe_index, DEDUPE_MODE
+from resumable import upload_resumable
+from prefetch import prefetch_spool
+from catalog import catalog
+from archive import PostArchive
+from media_processing import process_media, sniff_video_type, VIDEO_SOURCE_MAX_SIZE
+
 # 讀取環境變數
 GOOGLE_SERVICE_ACCOUNT_JSON = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON")
 GOOGLE_DRIVE_FOLDER_ID = os.environ.get("GOOGLE_DRIVE_FOLDER_ID")
+# 將所有 Google API 請求（包含上傳與批次請求）送到其他端點，例如 bench/ 中的模擬伺服器
+GOOGLE_API_ENDPOINT = os.environ.get("GOOGLE_API_ENDPOINT")
+
+# 同時進行的 Telegram 下載與 Drive 上傳數量上限
+TELEGRAM_DOWNLOAD_CONCURRENCY = int(os.environ.get("TELEGRAM_DOWNLOAD_CONCURRENCY", 4))
+DRIVE_UPLOAD_CONCURRENCY = int(os.environ.get("DRIVE_UPLOAD_CONCURRENCY", 4))
+
+download_semaphore = asyncio.Semaphore(TELEGRAM_DOWNLOAD_CONCURRENCY)
+upload_semaphore = asyncio.Semaphore(DRIVE_UPLOAD_CONCURRENCY)
 
 # 設定 Google API
 SCOPES = ['https://www.googleapis.com/auth/drive']
@@ -19,391 +43,583 @@ SCOPES = ['https://www.googleapis.com/auth/drive']
 creds = None
 drive_service = None
 
+def _build_service(name, version):
+    """建立 Google API 服務；設定 GOOGLE_API_ENDPOINT 時改寫探索文件中的 rootUrl"""
+    if not GOOGLE_API_ENDPOINT:
+        return build(name, version, credentials=creds)
+    # client_options 的 api_endpoint 不會影響上傳與批次請求的網址，因此直接修改探索文件
+    document = json.loads(get_static_doc(name, version))
+    document['rootUrl'] = GOOGLE_API_ENDPOINT.rstrip('/') + '/'
+    document['baseUrl'] = document['rootUrl'] + document['servicePath']
+    return build_from_document(document, credentials=creds)
+
 try:
     if GOOGLE_SERVICE_ACCOUNT_JSON:
         creds_info = json.loads(GOOGLE_SERVICE_ACCOUNT_JSON)
         creds = Credentials.from_service_account_info(creds_info, scopes=SCOPES)
-        drive_service = build('drive', 'v3', credentials=creds)
+        drive_service = _build_service('drive', 'v3')
 except Exception as e:
     print(f"Error initializing Google Drive: {e}")
 
-async def get_or_create_custom_folder(folder_name):
-    """取得或建立自定義名稱的資料夾"""
-    if not drive_service:
-        return None
-    
+# 同時送出的查詢與建立資料夾、文件等中繼資料請求合併為一次批次請求
+drive_batcher = DriveBatcher(drive_service)
+
+def _escape_query(value):
+    """跳脫 Drive 查詢字串中的特殊字元"""
+    return str(value).replace("\\", "\\\\").replace("'", "\\'")
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# 建立檔案時指定以 generateIds 預先取得的 ID，請求逾時後重試會得到 409 而不是重複的檔案
+FILE_ID_BATCH_SIZE = 100
+SHORTCUT_MIME_TYPE = 'application/vnd.google-apps.shortcut'
+# 捷徑須使用 type='shortcuts' 產生的 ID
+_file_ids = {'files': [], 'shortcuts': []}
+_file_ids_lock = asyncio.Lock()
+
+async def _new_file_ids(count=1, id_type='files'):
+    """取得 count 個預先產生的檔案 ID，不足時以一次 generateIds 補充"""
+    pool = _file_ids[id_type]
+    async with _file_ids_lock:
+        if len(pool) < count:
+            generated = await drive_execute(drive_service.files().generateIds(
+                count=max(count, FILE_ID_BATCH_SIZE), space='drive', type=id_type
+            ))
+            pool.extend(generated['ids'])
+        ids = pool[:count]
+        del pool[:count]
+    return ids
+
+async def _create_file(file_metadata, media=None, fields='id, webViewLink', upload_key=None):
+    """以預先產生的 ID 建立檔案，含可續傳的媒體內容時分塊上傳，不含媒體內容時與其他請求合併為批次
+
+    ID 已存在 (409) 表示先前逾時或中斷的請求其實已建立檔案，直接回傳該檔案。
+    """
+    body = dict(file_metadata)
+    if 'id' not in body:
+        id_type = 'shortcuts' if body.get('mimeType') == SHORTCUT_MIME_TYPE else 'files'
+        body['id'] = (await _new_file_ids(id_type=id_type))[0]
+    request = drive_service.files().create(body=body, media_body=media, fields=fields)
     try:
-        # 搜尋是否已存在該名稱的資料夾
-        query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and '{GOOGLE_DRIVE_FOLDER_ID}' in parents and trashed=false"
-        results = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=1).execute()
-        files = results.get('files', [])
-        
-        if files:
-            return files[0]['id']
-        
-        # 如果不存在，建立新資料夾
+        if media is not None and media.resumable():
+            return await upload_resumable(request, upload_key)
+        if media is None:
+            return await drive_batcher.execute(request)
+        return await drive_execute(request)
+    except HttpError as e:
+        if e.resp.status != 409:
+            raise
+        return await drive_batcher.execute(drive_service.files().get(fileId=body['id'], fields=fields))
+
+async def _create_folder_chain(parent_id, folder_names):
+    """在父資料夾下建立多層巢狀的新資料夾，回傳各層的 ID
+
+    新資料夾下的子資料夾必定不存在，因此不需查詢；批次請求不保證執行順序，
+    子資料夾必須等父資料夾建立後才能建立，所以依序逐層建立，
+    每一層與其他同時建立的資料夾或文件合併在同一個批次中送出。
+    """
+    folder_ids = await _new_file_ids(len(folder_names))
+
+    created = []
+    current_parent = parent_id
+    for folder_name, folder_id in zip(folder_names, folder_ids):
         file_metadata = {
+            'id': folder_id,
             'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [GOOGLE_DRIVE_FOLDER_ID]
+            'mimeType': FOLDER_MIME_TYPE,
+            'parents': [current_parent]
         }
-        folder = drive_service.files().create(body=file_metadata, fields='id').execute()
-        return folder.get('id')
-    except Exception as e:
-        print(f"Error getting/creating custom folder: {e}")
+        folder = await _create_file(file_metadata, fields='id')
+        current_parent = folder.get('id')
+        created.append(current_parent)
+    return created
+
+def _folder_loader(child_names=()):
+    """建立資料夾查詢函數；資料夾不存在時連同其下的 child_names 子資料夾一併建立
+
+    多個工作行程時經由共用索引查詢與建立，同一個資料夾同時只有一個行程建立；
+    子資料夾也須經由共用索引建立，因此不一併建立。
+    """
+    if shared_folders:
+        child_names = ()
+
+    async def find_or_create(parent_id, folder_name):
+        query = f"name='{_escape_query(folder_name)}' and mimeType='{FOLDER_MIME_TYPE}' and '{parent_id}' in parents and trashed=false"
+        try:
+            results = await drive_batcher.execute(drive_service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=1))
+            files = results.get('files', [])
+
+            if files:
+                return files[0]['id']
+
+            # 如果不存在，建立新資料夾；新資料夾下的子資料夾必定也不存在，不需再查詢
+            folder_ids = await _create_folder_chain(parent_id, [folder_name, *child_names])
+            current_parent = folder_ids[0]
+            for child_name, child_id in zip(child_names, folder_ids[1:]):
+                folder_cache.set(current_parent, child_name, child_id)
+                current_parent = child_id
+            return folder_ids[0]
+        except HttpError as e:
+            # 父資料夾已被刪除時，清除其快取
+            if e.resp.status == 404:
+                folder_cache.invalidate(parent_id)
+            raise
+
+    if not shared_folders:
+        return find_or_create
+
+    async def loader(parent_id, folder_name):
+        return await shared_folders.resolve(parent_id, folder_name, find_or_create)
+    return loader
+
+async def get_or_create_custom_folder(folder_name, child_names=()):
+    """取得或建立自定義名稱的資料夾"""
+    if not drive_service:
         return None
+    
+    return await folder_cache.resolve(GOOGLE_DRIVE_FOLDER_ID, folder_name, _folder_loader(child_names))
 
-async def get_or_create_date_folder(custom_folder_id, date_str):
+async def get_or_create_date_folder(custom_folder_id, date_str, child_names=()):
     """在自定義資料夾下建立日期資料夾"""
     if not drive_service:
         return None
     
-    try:
-        # 搜尋是否已存在該日期的資料夾
-        query = f"name='{date_str}' and mimeType='application/vnd.google-apps.folder' and '{custom_folder_id}' in parents and trashed=false"
-        results = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=1).execute()
-        files = results.get('files', [])
-        
-        if files:
-            return files[0]['id']
-        
-        # 如果不存在，建立新資料夾
-        file_metadata = {
-            'name': date_str,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [custom_folder_id]
-        }
-        folder = drive_service.files().create(body=file_metadata, fields='id').execute()
-        return folder.get('id')
-    except Exception as e:
-        print(f"Error getting/creating date folder: {e}")
-        return None
+    return await folder_cache.resolve(custom_folder_id, date_str, _folder_loader(child_names))
 
 async def get_or_create_message_folder(date_folder_id, message_id):
     """取得或建立用於存放同一訊息的資料夾"""
     if not drive_service:
         return None
     
-    try:
-        folder_name = f"message_{message_id}"
-        query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and '{date_folder_id}' in parents and trashed=false"
-        results = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=1).execute()
-        files = results.get('files', [])
-        
-        if files:
-            return files[0]['id']
-        
-        # 建立新資料夾
-        file_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [date_folder_id]
-        }
-        folder = drive_service.files().create(body=file_metadata, fields='id').execute()
-        return folder.get('id')
-    except Exception as e:
-        print(f"Error getting/creating message folder: {e}")
+    return await folder_cache.resolve(date_folder_id, f"message_{message_id}", _folder_loader())
+
+async def get_message_folder(custom_folder_name, message_id, date_str=None):
+    """依序解析 自定義資料夾/日期/message_{id} 並回傳訊息資料夾 ID"""
+    date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+    message_folder_name = f"message_{message_id}"
+
+    custom_folder_id = await get_or_create_custom_folder(custom_folder_name, (date_str, message_folder_name))
+    if not custom_folder_id:
         return None
 
-async def upload_text(content, message_id, custom_folder_name):
-    """上傳文字到 Google Drive"""
-    if not drive_service:
+    date_folder_id = await get_or_create_date_folder(custom_folder_id, date_str, (message_folder_name,))
+    if not date_folder_id:
         return None
 
-    try:
-        # 取得自定義資料夾
-        custom_folder_id = await get_or_create_custom_folder(custom_folder_name)
-        if not custom_folder_id:
-            return None
-        
-        # 取得日期資料夾
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        date_folder_id = await get_or_create_date_folder(custom_folder_id, date_str)
-        if not date_folder_id:
-            return None
-        
-        # 取得訊息資料夾
-        message_folder_id = await get_or_create_message_folder(date_folder_id, message_id)
+    return await get_or_create_message_folder(date_folder_id, message_id)
+
+async def create_in_message_folder(custom_folder_name, message_id, file_metadata, media=None, fields='id, webViewLink', upload_key=None):
+    """在訊息資料夾中建立檔案；資料夾已被刪除 (404) 時清除快取並重試一次
+
+    含媒體內容時使用可續傳的分塊上傳，upload_key 相同的上傳會從先前的進度繼續。
+    無法取得訊息資料夾時拋出例外，不會靜默略過。
+    """
+    for attempt in range(2):
+        message_folder_id = await get_message_folder(custom_folder_name, message_id)
         if not message_folder_id:
-            return None
-        
-        timestamp = datetime.now().strftime("%H-%M-%S")
-        file_name = f"text_{timestamp}.txt"
-        
-        file_metadata = {
-            'name': file_name,
-            'parents': [message_folder_id]
-        }
-        
-        media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype='text/plain', resumable=True)
-        
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
-        
-        return file.get('webViewLink')
-    except Exception as e:
-        print(f"Error uploading text: {e}")
-        return None
+            raise RuntimeError(f"Unable to resolve message folder for {custom_folder_name}/message_{message_id}")
+
+        body = dict(file_metadata, parents=[message_folder_id])
+        key = f"{message_folder_id}:{upload_key}" if upload_key else None
+        try:
+            return await _create_file(body, media, fields=fields, upload_key=key)
+        except HttpError as e:
+            if e.resp.status != 404 or attempt:
+                raise
+            # 上層資料夾已被刪除，清除快取後重新解析一次
+            custom_folder_id = folder_cache.get(GOOGLE_DRIVE_FOLDER_ID, custom_folder_name)
+            folder_cache.invalidate(custom_folder_id or message_folder_id)
 
-async def upload_photo(image_url, message_id, custom_folder_name, caption=""):
-    """上傳圖片到 Google Drive"""
+async def upload_text(content, message_id, custom_folder_name):
+    """上傳文字到 Google Drive，失敗時拋出例外"""
     if not drive_service:
         return None
 
+    timestamp = datetime.now().strftime("%H-%M-%S")
+    file_name = f"text_{timestamp}.txt"
+    
+    file_metadata = {
+        'name': file_name
+    }
+    
+    media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype='text/plain', resumable=True)
+    
+    file = await create_in_message_folder(custom_folder_name, message_id, file_metadata, media)
+    
+    await _record_upload(custom_folder_name, message_id, 'text', file, size=len(content.encode('utf-8')), caption=content)
+    return file.get('webViewLink')
+
+async def _record_upload(custom_folder_name, message_id, kind, file, **details):
+    """將已上傳的檔案記錄到本地索引，索引失敗不影響上傳結果"""
     try:
-        # 下載圖片
-        async with httpx.AsyncClient() as client:
-            response = await client.get(image_url)
-            response.raise_for_status()
-            image_data = response.content
-
-        # 取得自定義資料夾
-        custom_folder_id = await get_or_create_custom_folder(custom_folder_name)
-        if not custom_folder_id:
-            return None
-        
-        # 取得日期資料夾
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        date_folder_id = await get_or_create_date_folder(custom_folder_id, date_str)
-        if not date_folder_id:
-            return None
-        
-        # 取得訊息資料夾
-        message_folder_id = await get_or_create_message_folder(date_folder_id, message_id)
-        if not message_folder_id:
-            return None
+        await catalog.record(custom_folder_name, message_id, kind, file, **details)
+    except Exception as e:
+        print(f"Error recording {kind} in catalog: {e}")
 
-        timestamp = datetime.now().strftime("%H-%M-%S")
-        file_name = f"photo_{timestamp}.jpg"
-        
+# 各類媒體的上傳設定
+MEDIA_TYPES = {
+    'photo': {'extension': 'jpg', 'mimetype': 'image/jpeg', 'max_size': None, 'timeout': 30.0},
+    # 啟用轉檔時接受較大的原始影片，上傳前再壓縮到 VIDEO_MAX_SIZE 以內
+    'video': {'extension': 'mp4', 'mimetype': 'video/mp4', 'max_size': VIDEO_SOURCE_MAX_SIZE, 'timeout': 60.0},
+}
+
+async def _link_duplicate(existing, message_id, custom_folder_name):
+    """處理重複媒體：依 DEDUPE_MODE 直接略過或建立指向既有檔案的捷徑"""
+    if DEDUPE_MODE == "shortcut":
         file_metadata = {
-            'name': file_name,
-            'parents': [message_folder_id],
-            'description': caption
+            'name': f"duplicate_{existing['drive_file_id']}",
+            'mimeType': SHORTCUT_MIME_TYPE,
+            'shortcutDetails': {'targetId': existing['drive_file_id']}
         }
-        
-        media = MediaIoBaseUpload(io.BytesIO(image_data), mimetype='image/jpeg', resumable=True)
-        
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
-        
-        return file.get('webViewLink')
-    except Exception as e:
-        print(f"Error uploading photo: {e}")
-        return None
+        await create_in_message_folder(custom_folder_name, message_id, file_metadata, fields='id')
+    await dedupe_index.count_duplicate(existing['size'])
+    return {'id': existing['drive_file_id'], 'webViewLink': existing['web_link']}
 
-async def upload_video(video_url, message_id, custom_folder_name, caption=""):
-    """上傳影片到 Google Drive"""
-    if not drive_service:
-        return None
+async def _fetch_media(kind, file_url, file_unique_id):
+    """取得媒體內容，回傳 (檔案物件, 大小, SHA-256 雜湊, 是否為預先下載的檔案)
+
+    轉發時已預先下載的檔案直接使用，否則以串流方式下載媒體。
+    使用預先下載的檔案時，呼叫端須在完成後呼叫 prefetch_spool.release 或 discard。
+    """
+    media_type = MEDIA_TYPES[kind]
+    prefetched = await prefetch_spool.take(file_unique_id) if prefetch_spool else None
+    if prefetched:
+        media_file, size, content_hash = prefetched
+        return media_file, size, content_hash, True
+    async with download_semaphore:
+        media_file, size, content_hash = await download_to_spool(
+            file_url, max_size=media_type['max_size'], timeout=media_type['timeout']
+        )
+    return media_file, size, content_hash, False
+
+async def _upload_media(kind, file_url, message_id, custom_folder_name, caption, file_unique_id):
+    """下載 Telegram 媒體並上傳到 Google Drive，已備份過的媒體不會重複傳輸
+
+    回傳 {'id', 'webViewLink'}；重複的媒體回傳既有檔案。
+    """
+    media_type = MEDIA_TYPES[kind]
+
+    # 相同 file_unique_id 的檔案已上傳過，不需要下載
+    if dedupe_index and file_unique_id:
+        existing = await dedupe_index.find_by_unique_id(file_unique_id)
+        if existing:
+            try:
+                file = await _link_duplicate(existing, message_id, custom_folder_name)
+                if prefetch_spool:
+                    prefetch_spool.discard(file_unique_id)
+                await _record_upload(custom_folder_name, message_id, kind, file, size=existing['size'],
+                               content_hash=existing['content_hash'], caption=caption)
+                return file
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                # 原始檔案已從 Drive 刪除，重新上傳
+                await dedupe_index.forget(existing['drive_file_id'])
+
+    media_file, size, content_hash, prefetched = await _fetch_media(kind, file_url, file_unique_id)
 
     try:
-        # 下載影片
-        async with httpx.AsyncClient() as client:
-            response = await client.get(video_url, timeout=60.0)
-            response.raise_for_status()
-            video_data = response.content
-        
-        # 檢查檔案大小（最大 50MB）
-        if len(video_data) > 50 * 1024 * 1024:
-            return "Error: Video file exceeds 50MB limit"
-
-        # 取得自定義資料夾
-        custom_folder_id = await get_or_create_custom_folder(custom_folder_name)
-        if not custom_folder_id:
-            return None
-        
-        # 取得日期資料夾
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        date_folder_id = await get_or_create_date_folder(custom_folder_id, date_str)
-        if not date_folder_id:
-            return None
-        
-        # 取得訊息資料夾
-        message_folder_id = await get_or_create_message_folder(date_folder_id, message_id)
-        if not message_folder_id:
-            return None
+        with media_file:
+            # 內容相同的檔案已上傳過，不需要再次上傳
+            existing = await dedupe_index.find_by_hash(content_hash) if dedupe_index else None
+            if existing:
+                if file_unique_id:
+                    await dedupe_index.record(file_unique_id, content_hash, existing['drive_file_id'], existing['web_link'], size)
+                file = await _link_duplicate(existing, message_id, custom_folder_name)
+            else:
+                # 依設定重新壓縮圖片或轉檔影片，不需處理時上傳原始檔案
+                processed = await process_media(kind, media_file, size)
+                upload_file = processed['file'] if processed else media_file
+                extension, mimetype = media_type['extension'], media_type['mimetype']
+                if processed:
+                    extension, mimetype = processed['extension'], processed['mimetype']
+                elif kind == 'video':
+                    extension, mimetype = sniff_video_type(media_file)
 
-        timestamp = datetime.now().strftime("%H-%M-%S")
-        file_name = f"video_{timestamp}.mp4"
-        
-        file_metadata = {
-            'name': file_name,
-            'parents': [message_folder_id],
-            'description': caption
-        }
-        
-        media = MediaIoBaseUpload(io.BytesIO(video_data), mimetype='video/mp4', resumable=True)
-        
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
-        
-        return file.get('webViewLink')
-    except Exception as e:
-        print(f"Error uploading video: {e}")
-        return None
+                # 同一次保存的媒體並行上傳，時間可能相同，加上識別碼避免檔名重複
+                timestamp = datetime.now().strftime("%H-%M-%S")
+                file_name = f"{kind}_{timestamp}_{file_unique_id or content_hash[:12]}.{extension}"
+                
+                file_metadata = {
+                    'name': file_name,
+                    'description': caption
+                }
+                if processed and processed['thumbnail']:
+                    file_metadata['contentHints'] = {'thumbnail': {
+                        'image': base64.urlsafe_b64encode(processed['thumbnail']).decode('ascii'),
+                        'mimeType': 'image/jpeg'
+                    }}
+                
+                media = media_upload(upload_file, mimetype)
+                # 去重以原始檔案的雜湊為準，續傳工作階段則以實際上傳的內容區分
+                upload_key = processed['hash'] if processed else content_hash
+                
+                try:
+                    async with upload_semaphore:
+                        file = await create_in_message_folder(custom_folder_name, message_id, file_metadata, media, upload_key=upload_key)
+                finally:
+                    if processed:
+                        processed['file'].close()
+                if processed:
+                    size = processed['size']
+
+                if dedupe_index:
+                    await dedupe_index.record(file_unique_id, content_hash, file['id'], file.get('webViewLink'), size)
+    finally:
+        # 上傳失敗時保留預先下載的檔案供下次使用
+        if prefetched:
+            prefetch_spool.release(file_unique_id)
+
+    if prefetched:
+        prefetch_spool.discard(file_unique_id)
+    await _record_upload(custom_folder_name, message_id, kind, file, size=size, content_hash=content_hash, caption=caption)
+    return file
+
+async def upload_media(kind, file_url, message_id, custom_folder_name, caption="", file_unique_id=None):
+    """上傳圖片 ('photo') 或影片 ('video') 到 Google Drive，回傳 {'id', 'webViewLink'}
 
-async def generate_daily_summary(custom_folder_name, date_str):
-    """生成每日彙總報告"""
+    失敗時拋出例外，讓呼叫端記錄錯誤原因。
+    """
     if not drive_service:
         return None
-    
+    return await _upload_media(kind, file_url, message_id, custom_folder_name, caption, file_unique_id)
+
+async def upload_archive(texts, media, message_id, custom_folder_name):
+    """將一次 /save 的文字與媒體打包成一個 ZIP 上傳到 Google Drive
+
+    media 為 (種類, 下載網址, 說明, file_unique_id) 的清單。所有媒體同時開始下載，
+    依序寫入磁碟上的封存檔，寫入後立即釋放，不會將整個封存檔保留在記憶體中。
+    回傳 ({'id', 'webViewLink'}, 已封存的項目數, 錯誤訊息清單, 下載失敗的媒體在 media 中的索引)。
+    """
+    if not drive_service:
+        return None, 0, [], []
+
+    labels = {'photo': '圖片', 'video': '影片'}
+    post_archive = PostArchive(message_id, custom_folder_name)
+    errors = []
+    failed = []
+    # 已寫入封存檔的預先下載檔案，上傳成功後才刪除，失敗時保留供下次使用
+    prefetched_keys = []
+    downloads = [
+        asyncio.create_task(_fetch_media(kind, file_url, file_unique_id))
+        for kind, file_url, _, file_unique_id in media
+    ]
+    file = None
     try:
-        custom_folder_id = await get_or_create_custom_folder(custom_folder_name)
-        if not custom_folder_id:
-            return None
-        
-        date_folder_id = await get_or_create_date_folder(custom_folder_id, date_str)
-        if not date_folder_id:
-            return None
-        
-        # 列出該日期資料夾中的所有訊息資料夾
-        query = f"mimeType='application/vnd.google-apps.folder' and '{date_folder_id}' in parents and trashed=false"
-        results = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=100).execute()
-        message_folders = results.get('files', [])
-        
-        # 生成報告內容
-        report_content = f"""朋友圈內容彙總報告
-生成時間：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-日期：{date_str}
-分類：{custom_folder_name}
-
-本日共備份 {len(message_folders)} 條訊息
-
-訊息列表：
-"""
-        for i, folder in enumerate(message_folders, 1):
-            report_content += f"{i}. {folder['name']}\n"
-        
-        report_content += "\n所有檔案已儲存到 Google Drive，請查看相應的連結。\n"
-        
-        # 上傳報告
-        file_metadata = {
-            'name': f"daily_summary_{date_str}.txt",
-            'parents': [date_folder_id]
-        }
-        
-        media = MediaIoBaseUpload(io.BytesIO(report_content.encode('utf-8')), mimetype='text/plain', resumable=True)
-        
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
-        
-        return file.get('webViewLink')
-    except Exception as e:
-        print(f"Error generating daily summary: {e}")
+        for text in texts:
+            post_archive.add_text(text)
+
+        for index, ((kind, _, caption, file_unique_id), download) in enumerate(zip(media, downloads)):
+            try:
+                media_file, size, content_hash, prefetched = await download
+            except Exception as e:
+                errors.append(f"{labels[kind]}下載失敗: {str(e)}")
+                failed.append(index)
+                continue
+            if prefetched:
+                prefetched_keys.append(file_unique_id)
+            with media_file:
+                extension = MEDIA_TYPES[kind]['extension']
+                if kind == 'video':
+                    extension, _ = sniff_video_type(media_file)
+                await asyncio.to_thread(
+                    post_archive.add_file, kind, extension, media_file, size, content_hash, caption, file_unique_id
+                )
+
+        if not post_archive.entries:
+            post_archive.discard()
+            return None, 0, errors, failed
+        archive_file, size, content_hash = await asyncio.to_thread(post_archive.close)
+
+        with archive_file:
+            timestamp = datetime.now().strftime("%H-%M-%S")
+            file_metadata = {
+                'name': f"post_{timestamp}.zip",
+                'description': f"{len(post_archive.entries)} 個項目，清單見 manifest.md"
+            }
+            media_body = media_upload(archive_file, 'application/zip')
+            # ZIP 內含建立時間，續傳以成員內容識別，重試時才能從先前的進度繼續
+            async with upload_semaphore:
+                file = await create_in_message_folder(custom_folder_name, message_id, file_metadata, media_body,
+                                                      upload_key=post_archive.content_key())
+    except BaseException:
+        for (_, _, _, file_unique_id), download in zip(media, downloads):
+            if download.done() and not download.cancelled() and download.exception() is None:
+                media_file, _, _, prefetched = download.result()
+                media_file.close()
+                if prefetched and file_unique_id not in prefetched_keys:
+                    prefetched_keys.append(file_unique_id)
+            else:
+                download.cancel()
+        post_archive.discard()
+        raise
+    finally:
+        for file_unique_id in prefetched_keys:
+            if file:
+                prefetch_spool.discard(file_unique_id)
+            else:
+                prefetch_spool.release(file_unique_id)
+
+    # 文字與說明寫入索引，讓 /search 可以找到封存檔
+    caption = "\n".join(texts + [entry['caption'] for entry in post_archive.entries if entry['caption']])
+    await _record_upload(custom_folder_name, message_id, 'archive', file, size=size, content_hash=content_hash, caption=caption)
+    return file, len(post_archive.entries), errors, failed
+
+async def list_all_files(query, fields='id, name'):
+    """列出符合查詢的所有檔案，依 nextPageToken 逐頁取得"""
+    files = []
+    page_token = None
+    while True:
+        results = await drive_execute(drive_service.files().list(
+            q=query,
+            spaces='drive',
+            fields=f'nextPageToken, files({fields})',
+            pageSize=1000,
+            pageToken=page_token
+        ))
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+async def find_folder(parent_id, folder_name):
+    """搜尋資料夾但不建立，不存在時回傳 None"""
+    folder_id = folder_cache.get(parent_id, folder_name)
+    if folder_id:
+        return folder_id
+
+    query = f"name='{_escape_query(folder_name)}' and mimeType='{FOLDER_MIME_TYPE}' and '{parent_id}' in parents and trashed=false"
+    results = await drive_batcher.execute(drive_service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=1))
+    files = results.get('files', [])
+    if not files:
         return None
+    folder_cache.set(parent_id, folder_name, files[0]['id'])
+    return files[0]['id']
+
+async def list_custom_folders():
+    """列出根目錄下所有自定義資料夾"""
+    query = f"mimeType='{FOLDER_MIME_TYPE}' and '{GOOGLE_DRIVE_FOLDER_ID}' in parents and trashed=false"
+    return await list_all_files(query)
+
+async def list_message_folders(date_folder_id):
+    """列出日期資料夾中的所有訊息資料夾"""
+    query = f"mimeType='{FOLDER_MIME_TYPE}' and '{date_folder_id}' in parents and trashed=false"
+    return await list_all_files(query, fields='id, name, createdTime')
+
+async def write_text_file(parent_id, file_name, content, file_id=None):
+    """建立文字檔，或在提供 file_id 時覆寫既有檔案的內容，回傳 {'id', 'webViewLink'}"""
+    media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype='text/plain')
+
+    if not file_id:
+        query = f"name='{_escape_query(file_name)}' and '{parent_id}' in parents and trashed=false"
+        results = await drive_batcher.execute(drive_service.files().list(q=query, spaces='drive', fields='files(id)', pageSize=1))
+        files = results.get('files', [])
+        if files:
+            file_id = files[0]['id']
+
+    if file_id:
+        try:
+            return await drive_execute(drive_service.files().update(
+                fileId=file_id,
+                media_body=media,
+                fields='id, webViewLink'
+            ))
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+
+    file_metadata = {
+        'name': file_name,
+        'parents': [parent_id]
+    }
+    return await _create_file(file_metadata, media)
 
 # Google Docs API 支援
 docs_service = None
 
 try:
     if GOOGLE_SERVICE_ACCOUNT_JSON:
-        docs_service = build('docs', 'v1', credentials=creds)
+        docs_service = _build_service('docs', 'v1')
 except Exception as e:
     print(f"Error initializing Google Docs: {e}")
 
+async def _create_doc_with_text(doc_title, message_id, custom_folder_name, content):
+    """在訊息資料夾中建立 Google Doc，並以一次 batchUpdate 寫入內容；寫入失敗時刪除文件並拋出例外"""
+    doc_body = {
+        'name': doc_title,
+        'mimeType': 'application/vnd.google-apps.document'
+    }
+    
+    # 在 Google Drive 中建立文件
+    doc = await create_in_message_folder(custom_folder_name, message_id, doc_body)
+
+    requests = [{
+        'insertText': {
+            'text': content,
+            'location': {'index': 1}
+        }
+    }]
+
+    try:
+        await drive_execute(docs_service.documents().batchUpdate(
+            documentId=doc['id'],
+            body={'requests': requests}
+        ))
+    except Exception:
+        # 寫入內容失敗時刪除空白文件，下次保存時重新建立
+        try:
+            await drive_execute(drive_service.files().delete(fileId=doc['id']))
+        except Exception as e:
+            print(f"Error deleting empty doc {doc['id']}: {e}")
+        raise
+
+    await _record_upload(custom_folder_name, message_id, 'doc', doc, size=len(content.encode('utf-8')), caption=content)
+    return doc
+
 async def create_google_doc(text_content, message_id, custom_folder_name, media_links=None):
-    """建立 Google Docs 文件來儲存文字訊息"""
+    """建立 Google Docs 文件來儲存文字訊息，回傳文件連結；失敗時拋出例外"""
     if not drive_service or not docs_service:
         return None
-    
-    try:
-        # 取得自定義資料夾
-        custom_folder_id = await get_or_create_custom_folder(custom_folder_name)
-        if not custom_folder_id:
-            return None
-        
-        # 取得日期資料夾
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        date_folder_id = await get_or_create_date_folder(custom_folder_id, date_str)
-        if not date_folder_id:
-            return None
-        
-        # 取得訊息資料夾
-        message_folder_id = await get_or_create_message_folder(date_folder_id, message_id)
-        if not message_folder_id:
-            return None
-        
-        # 建立 Google Docs 檔案
-        timestamp = datetime.now().strftime("%H-%M-%S")
-        doc_title = f"text_{timestamp}"
-        
-        doc_body = {
-            'title': doc_title,
-            'parents': [message_folder_id]
-        }
-        
-        # 在 Google Drive 中建立文件
-        doc = drive_service.files().create(
-            body=doc_body,
-            mimeType='application/vnd.google-apps.document',
-            fields='id, webViewLink'
-        ).execute()
-        
-        doc_id = doc.get('id')
-        doc_link = doc.get('webViewLink')
-        
-        # 準備文件內容
-        requests = []
-        
-        # 添加文字內容
-        requests.append({
-            'insertText': {
-                'text': text_content,
-                'location': {'index': 1}
-            }
-        })
-        
-        # 添加媒體連結（如果有）
-        if media_links:
-            requests.append({
-                'insertText': {
-                    'text': '\n\n相關媒體：\n',
-                    'location': {'index': len(text_content) + 1}
-                }
-            })
-            
-            current_index = len(text_content) + 14
-            for link_type, link_url in media_links:
-                link_text = f"• {link_type}: {link_url}\n"
-                requests.append({
-                    'insertText': {
-                        'text': link_text,
-                        'location': {'index': current_index}
-                    }
-                })
-                current_index += len(link_text)
-        
-        # 添加時間戳記
-        timestamp_text = f"\n\n建立時間：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        requests.append({
-            'insertText': {
-                'text': timestamp_text,
-                'location': {'index': 1}
-            }
-        })
-        
-        # 應用所有更改
-        if requests:
-            docs_service.documents().batchUpdate(
-                documentId=doc_id,
-                body={'requests': requests}
-            ).execute()
-        
-        return doc_link
-    
-    except Exception as e:
-        print(f"Error creating Google Doc: {e}")
+
+    # 同一次保存的文字並行建立，以內容雜湊區分同一秒建立的文件
+    timestamp = datetime.now().strftime("%H-%M-%S")
+    text_hash = hashlib.sha256(text_content.encode('utf-8')).hexdigest()[:8]
+
+    # 準備文件內容：文字、媒體連結（如果有）與時間戳記
+    content = text_content
+    if media_links:
+        content += '\n\n相關媒體：\n'
+        for link_type, link_url in media_links:
+            content += f"• {link_type}: {link_url}\n"
+    content += f"\n\n建立時間：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+
+    doc = await _create_doc_with_text(f"text_{timestamp}_{text_hash}", message_id, custom_folder_name, content)
+    return doc.get('webViewLink') if doc else None
+
+async def create_post_document(texts, media_items, message_id, custom_folder_name):
+    """將一次 /save 的所有文字與已上傳媒體的連結寫入同一份 Google Doc
+
+    media_items 為 {'kind': 'photo' 或 'video', 'file': {'id', 'webViewLink'}, 'caption'} 的清單。
+    圖片只寫入連結：Docs API 插入圖片時需要可匿名取得的網址，Drive 的檔案與縮圖網址都需要授權。
+    """
+    if not drive_service or not docs_service:
         return None
+
+    labels = {'photo': '圖片', 'video': '影片'}
+    content = '\n\n'.join(texts)
+
+    if media_items:
+        content += '\n\n相關媒體：\n'
+        counters = {}
+        for item in media_items:
+            counters[item['kind']] = counters.get(item['kind'], 0) + 1
+            line = f"• {labels[item['kind']]} {counters[item['kind']]}: {item['file'].get('webViewLink')}"
+            if item.get('caption'):
+                line += f"（{item['caption']}）"
+            content += line + '\n'
+
+    content += f"\n建立時間：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+
+    timestamp = datetime.now().strftime("%H-%M-%S")
+    doc = await _create_doc_with_text(f"post_{timestamp}", message_id, custom_folder_name, content)
+    return doc.get('webViewLink') if doc else None
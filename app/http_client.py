@@ -0,0 +1,48 @@
+# http_client.py
+
+import os
+import httpx
+
+# 共用 HTTP 連線池設定
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 30))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "true").lower() == "true"
+
+try:
+    import h2  # noqa: F401
+    _http2_available = True
+except ImportError:
+    _http2_available = False
+
+_client = None
+
+def _create_client():
+    """建立具備連線池與 keep-alive 的 AsyncClient"""
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=HTTP2_ENABLED and _http2_available)
+
+def get_client():
+    """取得應用程式共用的 AsyncClient，尚未啟動時自動建立"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+async def start():
+    """應用程式啟動時建立共用連線池"""
+    get_client()
+
+async def close():
+    """應用程式關閉時釋放共用連線池"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,48 @@
+# idempotency.py
+
+import os
+import time
+from collections import OrderedDict
+
+# 記錄最近處理過的 update_id，數量上限固定，超過時間窗口的記錄會被移除
+UPDATE_DEDUPE_SIZE = int(os.environ.get("UPDATE_DEDUPE_SIZE", 10000))
+UPDATE_DEDUPE_WINDOW = float(os.environ.get("UPDATE_DEDUPE_WINDOW", 3600))
+
+class RecentUpdates:
+    """固定容量、具時間窗口的 update_id 集合，用於略過 Telegram 重送的更新"""
+
+    def __init__(self, maxsize=UPDATE_DEDUPE_SIZE, window=UPDATE_DEDUPE_WINDOW):
+        self.maxsize = maxsize
+        self.window = window
+        self._seen = OrderedDict()
+        self.replays = 0
+
+    def _expire(self, now):
+        """移除超過時間窗口的記錄"""
+        while self._seen:
+            update_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at <= self.window:
+                break
+            del self._seen[update_id]
+
+    def check_and_add(self, update_id):
+        """回傳 True 表示此 update_id 已處理過；否則記錄並回傳 False"""
+        if update_id is None:
+            return False
+
+        now = time.monotonic()
+        self._expire(now)
+        if update_id in self._seen:
+            self.replays += 1
+            return True
+
+        self._seen[update_id] = now
+        if len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+        return False
+
+    def discard(self, update_id):
+        """移除記錄，讓之後重送的更新可以再次處理"""
+        self._seen.pop(update_id, None)
+
+recent_updates = RecentUpdates()
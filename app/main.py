@@ -1,6 +1,7 @@
 # main.py
 
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
 import os
 import sys
@@ -8,34 +9,114 @@ import sys
 # 添加父目錄到 Python 路徑
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from bot import handle_message
-from scheduler import start_scheduler, stop_scheduler
+from bot import handle_message, album_buffer, outbox
+from scheduler import start_scheduler, stop_scheduler, job_state
+import drive_async
+import media_processing
+import http_client
+from storage import session_store
+from task_queue import TaskQueue
+from work_queue import DurableTaskQueue, MULTI_WORKER, WORKERS
+from idempotency import recent_updates
+from summary import summary_writer, report_index
+from catalog import catalog
+from metrics import registry
+from folder_cache import folder_cache, shared_folders
+from prefetch import prefetch_spool
+from rate_limit import rate_limiter
+from dedupe import dedupe_index
+from resumable import upload_checkpoints
 
 app = FastAPI()
 
 BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 
+# 背景處理 Telegram 更新，讓 webhook 可以立即回應；多個工作行程時改用共用的持久化佇列
+task_queue = DurableTaskQueue(handle_message) if MULTI_WORKER else TaskQueue(handle_message)
+
+# 既有元件的計數在匯出時讀取
+registry.callback("wechat_backup_task_queue_depth", "Telegram updates queued or in progress", task_queue.depth)
+registry.callback("wechat_backup_outbox_depth", "Outbound Telegram messages waiting to be sent", outbox.depth)
+registry.callback("wechat_backup_outbox_messages_total", "Outbound Telegram messages by outcome",
+                  lambda: {'sent': outbox.sent, 'coalesced': outbox.coalesced, 'throttled': outbox.throttled, 'dropped': outbox.dropped},
+                  type="counter", label="outcome")
+registry.callback("wechat_backup_folder_cache_requests_total", "Drive folder cache lookups",
+                  lambda: {'hit': folder_cache.hits, 'miss': folder_cache.misses}, type="counter", label="result")
+registry.callback("wechat_backup_update_replays_total", "Telegram updates ignored as replays",
+                  lambda: recent_updates.replays + getattr(task_queue, 'replays', 0), type="counter")
+registry.callback("wechat_backup_rate_limit_rate", "Current Google API request rate per second",
+                  lambda: {kind: bucket.rate for kind, bucket in rate_limiter.buckets.items()}, label="kind")
+registry.callback("wechat_backup_rate_limit_throttled_total", "Google API responses that signalled rate limiting",
+                  lambda: {kind: bucket.throttled for kind, bucket in rate_limiter.buckets.items()}, type="counter", label="kind")
+registry.callback("wechat_backup_retry_budget_exhausted_total", "Google API retries refused by the retry budget",
+                  lambda: {kind: budget.exhausted for kind, budget in rate_limiter.budgets.items()}, type="counter", label="kind")
+if dedupe_index:
+    registry.callback("wechat_backup_dedupe_duplicates_skipped_total", "Media uploads skipped as duplicates",
+                      lambda: dedupe_index.stats()['duplicates_skipped'], type="counter")
+    registry.callback("wechat_backup_dedupe_bytes_saved_total", "Bytes not uploaded because the media was a duplicate",
+                      lambda: dedupe_index.stats()['bytes_saved'], type="counter")
+if prefetch_spool:
+    registry.callback("wechat_backup_prefetch_requests_total", "Prefetch spool lookups",
+                      lambda: {'hit': prefetch_spool.hits, 'miss': prefetch_spool.misses}, type="counter", label="result")
+    registry.callback("wechat_backup_prefetch_bytes", "Bytes held in the prefetch spool", lambda: prefetch_spool.total_bytes)
+
 @app.on_event("startup")
 async def startup_event():
     """應用程式啟動時執行"""
+    await http_client.start()
+    outbox.start()
+    task_queue.start()
     start_scheduler()
     print("Application started")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """應用程式關閉時執行"""
+    await task_queue.stop()
+    await album_buffer.flush()
+    await outbox.stop()
     stop_scheduler()
+    await summary_writer.flush()
+    drive_async.shutdown()
+    media_processing.shutdown()
+    await http_client.close()
+    session_store.close()
+    catalog.close()
+    report_index.close()
+    job_state.close()
+    upload_checkpoints.close()
+    if dedupe_index:
+        dedupe_index.close()
+    if shared_folders:
+        shared_folders.close()
     print("Application stopped")
 
 @app.post(f"/{BOT_TOKEN}")
 async def webhook(request: Request):
     update = await request.json()
-    await handle_message(update)
+    update_id = update.get("update_id")
+    if recent_updates.check_and_add(update_id):
+        # Telegram 重送的更新已處理過，直接回應
+        return {"status": "ok"}
+    if not await task_queue.submit(update):
+        # 佇列已滿，讓 Telegram 稍後重新傳送
+        recent_updates.discard(update_id)
+        return JSONResponse(status_code=503, content={"status": "busy"})
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文字格式的效能指標"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def index():
     return {"status": "ok", "message": "Telegram WeChat Backup Bot is running"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
+    port = int(os.environ.get("PORT", 8080))
+    if MULTI_WORKER:
+        # 多個工作行程需要以匯入字串啟動
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,228 @@
+# media_processing.py
+
+import os
+import io
+import shutil
+import hashlib
+import asyncio
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from transfer import FileTooLargeError, TELEGRAM_LOCAL_MODE, TELEGRAM_FILE_MAX_SIZE
+from metrics import observe
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# 上傳前處理圖片（重新壓縮或轉換格式）
+MEDIA_PROCESSING_ENABLED = os.environ.get("MEDIA_PROCESSING_ENABLED", "false").lower() == "true"
+# 圖片輸出格式：jpeg、webp 或 avif（avif 需要支援 AVIF 的 Pillow）
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+# 圖片最長邊的像素上限，0 為不縮小
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", 0))
+# 產生縮圖並作為 Drive 的 contentHints.thumbnail 上傳，0 為不產生
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", 0))
+
+# 影片大小上限；啟用轉檔時超過上限的影片會以 ffmpeg 壓縮到上限以內
+# 使用本地 Bot API 伺服器時預設為可下載的大小上限，讓長影片也能備份
+VIDEO_MAX_SIZE = int(os.environ.get(
+    "VIDEO_MAX_SIZE", TELEGRAM_FILE_MAX_SIZE if TELEGRAM_LOCAL_MODE else 50 * 1024 * 1024
+))
+VIDEO_TRANSCODE = os.environ.get("VIDEO_TRANSCODE", "false").lower() == "true"
+# 啟用轉檔時可接受的原始影片大小上限
+VIDEO_SOURCE_MAX_SIZE = int(os.environ.get(
+    "VIDEO_SOURCE_MAX_SIZE", 2 * 1024 * 1024 * 1024 if VIDEO_TRANSCODE else VIDEO_MAX_SIZE
+))
+VIDEO_MAX_HEIGHT = int(os.environ.get("VIDEO_MAX_HEIGHT", 720))
+VIDEO_AUDIO_BITRATE = int(os.environ.get("VIDEO_AUDIO_BITRATE", 96000))
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH", "ffmpeg")
+FFPROBE_PATH = os.environ.get("FFPROBE_PATH", "ffprobe")
+
+# 同時進行的圖片處理與轉檔數量，避免佔滿 CPU
+MEDIA_WORKERS = int(os.environ.get("MEDIA_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+IMAGE_FORMATS = {
+    'jpeg': {'extension': 'jpg', 'mimetype': 'image/jpeg', 'pil_format': 'JPEG'},
+    'webp': {'extension': 'webp', 'mimetype': 'image/webp', 'pil_format': 'WEBP'},
+    'avif': {'extension': 'avif', 'mimetype': 'image/avif', 'pil_format': 'AVIF'},
+}
+
+if MEDIA_PROCESSING_ENABLED and Image is None:
+    print("MEDIA_PROCESSING_ENABLED is set but Pillow is not installed, images will be uploaded as-is")
+if VIDEO_TRANSCODE and not shutil.which(FFMPEG_PATH):
+    print(f"VIDEO_TRANSCODE is set but {FFMPEG_PATH} was not found, oversize videos will be rejected")
+
+_pool = None
+_semaphore = asyncio.Semaphore(MEDIA_WORKERS)
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    return _pool
+
+def _size_limit():
+    """錯誤訊息中顯示的影片大小上限"""
+    return f"{VIDEO_MAX_SIZE // (1024 * 1024)}MB"
+
+def sniff_video_type(fileobj):
+    """依檔案開頭判斷影片容器，回傳 (副檔名, MIME 類型)"""
+    position = fileobj.tell()
+    header = fileobj.read(64)
+    fileobj.seek(position)
+    if header[4:8] == b'ftyp':
+        if header[8:12] == b'qt  ':
+            return 'mov', 'video/quicktime'
+        return 'mp4', 'video/mp4'
+    if header[:4] == b'\x1a\x45\xdf\xa3':
+        if b'webm' in header:
+            return 'webm', 'video/webm'
+        return 'mkv', 'video/x-matroska'
+    return 'mp4', 'video/mp4'
+
+def _convert_image(src_path, dst_path, image_format, quality, max_dimension, thumbnail_size):
+    """在工作行程中轉換圖片，回傳 JPEG 縮圖內容或 None"""
+    with Image.open(src_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if max_dimension:
+            image.thumbnail((max_dimension, max_dimension))
+        if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        options = {'quality': quality}
+        if image_format == 'jpeg':
+            options.update(optimize=True, progressive=True)
+        image.save(dst_path, format=IMAGE_FORMATS[image_format]['pil_format'], **options)
+
+        if not thumbnail_size:
+            return None
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=80)
+        return buffer.getvalue()
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+async def _run_command(*args):
+    """執行外部指令，回傳標準輸出；失敗時拋出 RuntimeError"""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"{args[0]} failed: {stderr.decode('utf-8', 'replace')[-500:]}")
+    return stdout
+
+async def _transcode_video(src_path, dst_path, thumbnail_path):
+    """以 ffmpeg 將影片壓縮到 VIDEO_MAX_SIZE 以內，依長度計算位元率"""
+    duration = float((await _run_command(
+        FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', src_path
+    )).strip() or 0)
+    if duration <= 0:
+        raise RuntimeError("Unable to determine video duration")
+
+    # 保留約 5% 給容器的額外開銷
+    video_bitrate = int(VIDEO_MAX_SIZE * 8 * 0.95 / duration) - VIDEO_AUDIO_BITRATE
+    if video_bitrate < 100000:
+        raise FileTooLargeError(f"Video is too long to fit in {_size_limit()}")
+
+    await _run_command(
+        FFMPEG_PATH, '-y', '-v', 'error', '-i', src_path,
+        '-vf', f"scale=-2:'min({VIDEO_MAX_HEIGHT},ih)'",
+        '-c:v', 'libx264', '-preset', 'veryfast',
+        '-b:v', str(video_bitrate), '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate * 2),
+        '-c:a', 'aac', '-b:a', str(VIDEO_AUDIO_BITRATE),
+        '-movflags', '+faststart', dst_path
+    )
+    if thumbnail_path:
+        # 縮圖只是附加資訊，失敗時仍上傳轉檔後的影片；短於 1 秒的影片取中間的畫面
+        try:
+            await _run_command(
+                FFMPEG_PATH, '-y', '-v', 'error', '-ss', f"{min(1.0, duration / 2):.3f}", '-i', dst_path,
+                '-frames:v', '1', '-vf', f"scale={THUMBNAIL_SIZE}:-2", thumbnail_path
+            )
+        except Exception as e:
+            print(f"Error extracting video thumbnail, uploading without it: {e}")
+
+def _source_path(fileobj, directory):
+    """將下載的暫存檔寫入磁碟，讓處理行程與 ffmpeg 可以依路徑讀取；本地檔案直接使用原始路徑"""
+    name = getattr(fileobj, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name
+    path = os.path.join(directory, 'source')
+    fileobj.seek(0)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(fileobj, f, 1024 * 1024)
+    fileobj.seek(0)
+    return path
+
+async def _result(path, extension, mimetype, thumbnail=None):
+    # 先開啟輸出檔再離開暫存目錄，刪除目錄後仍可從已開啟的檔案讀取
+    return {
+        'file': open(path, 'rb'),
+        'size': os.path.getsize(path),
+        'hash': await asyncio.to_thread(_hash_file, path),
+        'extension': extension,
+        'mimetype': mimetype,
+        'thumbnail': thumbnail,
+    }
+
+async def process_media(kind, fileobj, size):
+    """上傳前處理媒體，回傳 {'file', 'size', 'hash', 'extension', 'mimetype', 'thumbnail'}；不需處理時回傳 None
+
+    處理後的檔案比原始檔案大、或處理失敗時使用原始檔案；
+    超過 VIDEO_MAX_SIZE 且無法轉檔的影片拋出 FileTooLargeError。
+    """
+    if kind == 'photo' and not (MEDIA_PROCESSING_ENABLED and Image is not None and IMAGE_FORMAT in IMAGE_FORMATS):
+        return None
+    if kind == 'video' and size <= VIDEO_MAX_SIZE:
+        return None
+    if kind == 'video' and not (VIDEO_TRANSCODE and shutil.which(FFMPEG_PATH)):
+        raise FileTooLargeError(f"Video file exceeds {_size_limit()} limit")
+
+    with tempfile.TemporaryDirectory(prefix="media-") as directory:
+        src_path = await asyncio.to_thread(_source_path, fileobj, directory)
+        async with _semaphore:
+            if kind == 'photo':
+                output = IMAGE_FORMATS[IMAGE_FORMAT]
+                dst_path = os.path.join(directory, f"output.{output['extension']}")
+                loop = asyncio.get_running_loop()
+                try:
+                    with observe("media.image"):
+                        thumbnail = await loop.run_in_executor(
+                            _get_pool(), _convert_image, src_path, dst_path,
+                            IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MAX_DIMENSION, THUMBNAIL_SIZE
+                        )
+                except Exception as e:
+                    print(f"Error processing image, uploading original: {e}")
+                    return None
+                if os.path.getsize(dst_path) >= size:
+                    # 處理後沒有變小，直接上傳原始檔案
+                    return None
+                return await _result(dst_path, output['extension'], output['mimetype'], thumbnail)
+
+            dst_path = os.path.join(directory, "output.mp4")
+            thumbnail_path = os.path.join(directory, "thumbnail.jpg") if THUMBNAIL_SIZE else None
+            with observe("media.video"):
+                await _transcode_video(src_path, dst_path, thumbnail_path)
+            if os.path.getsize(dst_path) > VIDEO_MAX_SIZE:
+                raise FileTooLargeError(f"Transcoded video still exceeds {_size_limit()} limit")
+            thumbnail = None
+            if thumbnail_path and os.path.exists(thumbnail_path):
+                with open(thumbnail_path, 'rb') as f:
+                    thumbnail = f.read()
+            return await _result(dst_path, 'mp4', 'video/mp4', thumbnail)
+
+def shutdown():
+    """關閉處理行程池"""
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
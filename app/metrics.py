@@ -0,0 +1,227 @@
+# metrics.py
+
+import os
+import time
+import json
+import contextvars
+from contextlib import contextmanager
+
+# 記錄每次 /save 各階段的耗時，總耗時超過門檻時輸出明細
+METRICS_TRACE_SAVES = os.environ.get("METRICS_TRACE_SAVES", "false").lower() == "true"
+METRICS_TRACE_SLOW_SECONDS = float(os.environ.get("METRICS_TRACE_SLOW_SECONDS", 10))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """只增不減的計數器"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, key, value
+
+class Gauge(Counter):
+    """可增可減的數值"""
+
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._values[tuple(sorted(labels.items()))] = value
+
+class CallbackMetric:
+    """在匯出時呼叫函數取得目前數值，用於佇列深度與快取命中次數等既有的計數
+
+    指定 label 時，callback 回傳 {標籤值: 數值}。
+    """
+
+    def __init__(self, name, documentation, callback, type="gauge", label=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.type = type
+        self.label = label
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return
+        if value is None:
+            return
+        if self.label is None:
+            yield self.name, (), value
+            return
+        for label_value, item in value.items():
+            yield self.name, ((self.label, label_value),), item
+
+class Histogram:
+    """累積分佈的延遲直方圖"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry['counts'][i] += 1
+        entry['sum'] += value
+        entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """計算區塊的執行時間"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, entry in self._values.items():
+            for bound, count in zip(self.buckets, entry['counts']):
+                yield f"{self.name}_bucket", key + (("le", _format_value(bound)),), count
+            yield f"{self.name}_sum", key, entry['sum']
+            yield f"{self.name}_count", key, entry['count']
+
+class Registry:
+    """收集所有指標並以 Prometheus 文字格式匯出"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self._register(Gauge(name, documentation))
+
+    def callback(self, name, documentation, callback, type="gauge", label=None):
+        # 重新註冊時以新的函數取代
+        self._metrics[name] = CallbackMetric(name, documentation, callback, type, label)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# 熱路徑上的共用指標
+operation_seconds = registry.histogram(
+    "wechat_backup_operation_seconds", "Latency of Telegram and Google API operations"
+)
+bytes_transferred = registry.counter(
+    "wechat_backup_bytes_total", "Bytes downloaded from Telegram and uploaded to Drive"
+)
+google_api_retries = registry.counter(
+    "wechat_backup_google_api_retries_total", "Google API requests retried after throttling or transient errors"
+)
+saves_in_flight = registry.gauge(
+    "wechat_backup_saves_in_flight", "/save requests currently being processed"
+)
+save_seconds = registry.histogram(
+    "wechat_backup_save_seconds", "End-to-end latency of /save"
+)
+save_files = registry.counter(
+    "wechat_backup_save_files_total", "Files processed by /save"
+)
+
+class SaveTrace:
+    """一次 /save 中各階段的耗時"""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.started_at = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name, duration):
+        total, count = self.spans.get(name, (0.0, 0))
+        self.spans[name] = (total + duration, count + 1)
+
+    def finish(self):
+        """總耗時超過門檻時輸出各階段的累計時間（並行的階段會重疊）"""
+        elapsed = time.perf_counter() - self.started_at
+        if elapsed < METRICS_TRACE_SLOW_SECONDS:
+            return
+        spans = {name: {'seconds': round(total, 3), 'count': count} for name, (total, count) in self.spans.items()}
+        print(f"Slow save trace: {json.dumps({'chat_id': self.chat_id, 'seconds': round(elapsed, 3), 'spans': spans}, ensure_ascii=False)}")
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+@contextmanager
+def observe(operation):
+    """記錄操作耗時到直方圖，並加入目前 /save 的追蹤"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        operation_seconds.observe(duration, operation=operation)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(operation, duration)
+
+@contextmanager
+def trace_save(chat_id):
+    """追蹤一次 /save：更新進行中數量與總耗時，啟用時記錄各階段耗時"""
+    saves_in_flight.inc()
+    trace = SaveTrace(chat_id) if METRICS_TRACE_SAVES else None
+    token = current_trace.set(trace)
+    try:
+        with save_seconds.time():
+            yield
+    finally:
+        current_trace.reset(token)
+        saves_in_flight.dec()
+        if trace is not None:
+            trace.finish()
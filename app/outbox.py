@@ -0,0 +1,205 @@
+# outbox.py
+
+import os
+import time
+import random
+import asyncio
+from collections import deque
+
+from http_client import get_client
+from rate_limit import AdaptiveTokenBucket
+from metrics import observe
+from work_queue import WORKERS
+
+# Telegram 限制機器人每秒約 30 則訊息，同一個聊天約每秒 1 則
+# 全域速率為每個工作行程的上限，多個行程時預設平分
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", 30 / WORKERS))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", 1))
+# 連線錯誤或 5xx 時的重試次數
+TELEGRAM_SEND_MAX_ATTEMPTS = int(os.environ.get("TELEGRAM_SEND_MAX_ATTEMPTS", 5))
+TELEGRAM_OUTBOX_DRAIN_TIMEOUT = float(os.environ.get("TELEGRAM_OUTBOX_DRAIN_TIMEOUT", 10))
+
+class TelegramOutbox:
+    """依全域與每個聊天的速率限制發送 Telegram 訊息的佇列
+
+    同一個聊天的訊息依序發送；遇到 429 時依 retry_after 暫停該聊天後重送。
+    帶有 key 的訊息尚未送出前再次發送時只保留最新內容；進度訊息會編輯同一則訊息而不是發送新訊息。
+    """
+
+    def __init__(self, api_url, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 max_attempts=TELEGRAM_SEND_MAX_ATTEMPTS):
+        self.api_url = api_url
+        self.chat_interval = 1.0 / chat_rate
+        self.max_attempts = max_attempts
+        self._bucket = AdaptiveTokenBucket('telegram', global_rate, global_rate, min_rate=global_rate)
+        self._queues = {}
+        self._next_send = {}
+        self._busy = set()
+        self._progress = {}
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+        self.sent = 0
+        self.coalesced = 0
+        self.throttled = 0
+        self.dropped = 0
+
+    def start(self):
+        """啟動發送迴圈"""
+        self._task = asyncio.create_task(self._run(), name="telegram-outbox")
+
+    def depth(self):
+        """尚未送出的訊息數量"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def send(self, chat_id, text, key=None):
+        """將訊息加入佇列；相同 key 的訊息還在排隊時直接以新內容取代"""
+        self._enqueue({'chat_id': chat_id, 'text': text, 'key': key, 'progress': False, 'attempt': 0})
+
+    def progress(self, chat_id, key, text):
+        """發送或更新進度訊息：第一次發送新訊息，之後編輯同一則訊息"""
+        self._enqueue({'chat_id': chat_id, 'text': text, 'key': ('progress', key), 'progress': True, 'attempt': 0})
+
+    def end_progress(self, chat_id, key):
+        """結束進度訊息，之後以相同 key 呼叫 progress 會發送新訊息"""
+        progress_key = ('progress', key)
+        queue = self._queues.get(chat_id, ())
+        if any(item['key'] == progress_key for item in queue):
+            # 最後一次更新還在排隊，送出後再清除
+            self._enqueue({'chat_id': chat_id, 'key': None, 'end_progress': progress_key})
+        else:
+            self._progress.pop((chat_id, progress_key), None)
+
+    def _enqueue(self, item):
+        queue = self._queues.setdefault(item['chat_id'], deque())
+        if item.get('key') is not None:
+            for queued in reversed(queue):
+                if queued.get('end_progress') == item['key']:
+                    # 之前的進度訊息已結束，不能合併到舊的訊息
+                    break
+                if queued.get('key') == item['key']:
+                    queued['text'] = item['text']
+                    self.coalesced += 1
+                    return
+        queue.append(item)
+        self._idle.clear()
+        self._wakeup.set()
+
+    def _next_ready(self):
+        """找出可以發送的聊天，沒有時回傳 (None, 需要等待的秒數或 None)"""
+        now = time.monotonic()
+        ready_chat = None
+        ready_at = None
+        for chat_id, queue in self._queues.items():
+            if not queue or chat_id in self._busy:
+                continue
+            next_send = self._next_send.get(chat_id, 0)
+            if ready_at is None or next_send < ready_at:
+                ready_chat, ready_at = chat_id, next_send
+        if ready_chat is None:
+            return None, None
+        if ready_at > now:
+            return None, ready_at - now
+        return ready_chat, 0
+
+    async def _run(self):
+        while True:
+            chat_id, delay = self._next_ready()
+            if chat_id is None:
+                if not self._busy and not self.depth():
+                    self._idle.set()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            item = self._queues[chat_id].popleft()
+            if not self._queues[chat_id]:
+                del self._queues[chat_id]
+            if 'end_progress' in item:
+                self._progress.pop((chat_id, item['end_progress']), None)
+                continue
+
+            await self._bucket.acquire()
+            self._busy.add(chat_id)
+            self._next_send[chat_id] = time.monotonic() + self.chat_interval
+            asyncio.create_task(self._deliver(item))
+
+    async def _deliver(self, item):
+        chat_id = item['chat_id']
+        try:
+            await self._post(item)
+            self.sent += 1
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None:
+                self.throttled += 1
+                self._next_send[chat_id] = time.monotonic() + retry_after
+                self._requeue(item)
+            elif getattr(e, 'retryable', True) and item['attempt'] + 1 < self.max_attempts:
+                item['attempt'] += 1
+                self._next_send[chat_id] = time.monotonic() + random.uniform(0, 2 ** item['attempt'])
+                self._requeue(item)
+            else:
+                self.dropped += 1
+                print(f"Error sending message to {chat_id}: {e}")
+        finally:
+            self._busy.discard(chat_id)
+            self._wakeup.set()
+
+    def _requeue(self, item):
+        """放回佇列最前面；同一個 key 已有較新的內容排隊時直接捨棄"""
+        queue = self._queues.setdefault(item['chat_id'], deque())
+        if item['key'] is not None and any(queued.get('key') == item['key'] for queued in queue):
+            return
+        queue.appendleft(item)
+
+    async def _post(self, item):
+        chat_id = item['chat_id']
+        progress_id = self._progress.get((chat_id, item['key'])) if item['progress'] else None
+        if progress_id:
+            method = "editMessageText"
+            payload = {"chat_id": chat_id, "message_id": progress_id, "text": item['text']}
+        else:
+            method = "sendMessage"
+            payload = {"chat_id": chat_id, "text": item['text']}
+
+        client = get_client()
+        with observe(f"telegram.{method}"):
+            response = await client.post(f"{self.api_url}/{method}", json=payload)
+        data = response.json()
+        if data.get("ok"):
+            if item['progress'] and not progress_id:
+                self._progress[(chat_id, item['key'])] = data["result"]["message_id"]
+            return
+
+        description = data.get("description", "")
+        if response.status_code == 429:
+            raise TelegramError(description, retry_after=data.get("parameters", {}).get("retry_after", 1))
+        if progress_id and response.status_code == 400:
+            if "message is not modified" in description:
+                return
+            # 進度訊息已被刪除或無法編輯，改為發送新訊息
+            self._progress.pop((chat_id, item['key']), None)
+            raise TelegramError(description)
+        raise TelegramError(description, retryable=response.status_code >= 500)
+
+    async def stop(self, timeout=TELEGRAM_OUTBOX_DRAIN_TIMEOUT):
+        """等待佇列中的訊息送出後停止"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Telegram outbox drain timed out, {self.depth()} messages not sent")
+        if self._task:
+            self._task.cancel()
+
+class TelegramError(Exception):
+    """Telegram Bot API 回傳的錯誤"""
+
+    def __init__(self, description, retry_after=None, retryable=True):
+        super().__init__(description)
+        self.retry_after = retry_after
+        self.retryable = retryable if retry_after is None else True
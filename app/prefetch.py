@@ -0,0 +1,137 @@
+# prefetch.py
+
+import os
+import asyncio
+from collections import OrderedDict
+
+from storage import DATA_DIR
+from transfer import download_to_file, is_local_source
+from work_queue import MULTI_WORKER
+
+# 在轉發媒體時就先下載到本地暫存區，/save 時只需要上傳
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "false").lower() == "true"
+PREFETCH_DIR = os.environ.get("PREFETCH_DIR", os.path.join(DATA_DIR, "spool"))
+PREFETCH_MAX_BYTES = int(os.environ.get("PREFETCH_MAX_BYTES", 1024 * 1024 * 1024))
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", 2))
+
+class PrefetchSpool:
+    """以 file_unique_id 為鍵、有磁碟容量上限並依 LRU 淘汰的本地下載暫存區
+
+    檔案下載完成後命名為 {key}.{sha256}，重新啟動後仍可使用。
+    """
+
+    def __init__(self, directory=PREFETCH_DIR, max_bytes=PREFETCH_MAX_BYTES, concurrency=PREFETCH_CONCURRENCY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._tasks = {}
+        self._in_use = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """載入已存在的暫存檔，移除下載到一半的檔案"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            key, _, content_hash = name.rpartition(".")
+            if name.endswith(".part") or not key:
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_atime, key, path, stat.st_size, content_hash))
+        for _, key, path, size, content_hash in sorted(entries):
+            self._entries[key] = (path, size, content_hash)
+            self.total_bytes += size
+
+    def _evict(self):
+        """超過容量上限時刪除最久未使用的檔案"""
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key not in self._in_use:
+                self.discard(key)
+
+    def start(self, key, url, max_size=None, timeout=60.0):
+        """在背景開始下載；已暫存或正在下載時不重複下載"""
+        if not key or key in self._entries or key in self._tasks:
+            return
+        if is_local_source(url):
+            # 本地 Bot API 伺服器的檔案已在磁碟上，上傳時直接讀取
+            return
+        task = asyncio.create_task(self._download(key, url, max_size, timeout))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def _download(self, key, url, max_size, timeout):
+        part_path = os.path.join(self.directory, f"{key}.part")
+        try:
+            async with self._semaphore:
+                with open(part_path, "wb") as fileobj:
+                    size, content_hash = await download_to_file(url, fileobj, max_size, timeout)
+            path = os.path.join(self.directory, f"{key}.{content_hash}")
+            os.replace(part_path, path)
+        except Exception as e:
+            print(f"Error prefetching {key}: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return
+
+        self._entries[key] = (path, size, content_hash)
+        self.total_bytes += size
+        self._evict()
+
+    async def take(self, key):
+        """取得暫存的檔案，回傳 (開啟的檔案物件, 檔案大小, SHA-256 雜湊)，沒有時回傳 None
+
+        使用中的檔案不會被淘汰，直到呼叫 release 或 discard。
+        """
+        if not key:
+            return None
+        task = self._tasks.get(key)
+        if task is not None:
+            await asyncio.shield(task)
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        path, size, content_hash = entry
+        try:
+            fileobj = open(path, "rb")
+        except FileNotFoundError:
+            self.discard(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._in_use.add(key)
+        self.hits += 1
+        return fileobj, size, content_hash
+
+    def release(self, key):
+        """上傳失敗時保留檔案供下次使用"""
+        self._in_use.discard(key)
+        self._evict()
+
+    def discard(self, key):
+        """刪除暫存檔（上傳成功或不再需要時）"""
+        self._in_use.discard(key)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        path, size, _ = entry
+        self.total_bytes -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+if PREFETCH_ENABLED and MULTI_WORKER:
+    # 暫存區的容量與下載中的檔案只在單一行程內追蹤，多個行程共用目錄時會互相刪除檔案
+    print("PREFETCH_ENABLED is ignored when WORKERS > 1")
+
+prefetch_spool = PrefetchSpool() if PREFETCH_ENABLED and not MULTI_WORKER else None
@@ -0,0 +1,137 @@
+# rate_limit.py
+
+import os
+import time
+import random
+import asyncio
+
+# 各類 Google API 請求的初始與最大速率（每秒請求數）
+DRIVE_READ_RATE = float(os.environ.get("DRIVE_READ_RATE", 10))
+DRIVE_READ_MAX_RATE = float(os.environ.get("DRIVE_READ_MAX_RATE", 50))
+DRIVE_WRITE_RATE = float(os.environ.get("DRIVE_WRITE_RATE", 3))
+DRIVE_WRITE_MAX_RATE = float(os.environ.get("DRIVE_WRITE_MAX_RATE", 10))
+DOCS_WRITE_RATE = float(os.environ.get("DOCS_WRITE_RATE", 1))
+DOCS_WRITE_MAX_RATE = float(os.environ.get("DOCS_WRITE_MAX_RATE", 1))
+
+# AIMD：成功時線性增加速率，被限流時乘以此係數
+RATE_INCREASE = float(os.environ.get("RATE_INCREASE", 0.5))
+RATE_DECREASE_FACTOR = float(os.environ.get("RATE_DECREASE_FACTOR", 0.5))
+RATE_MIN = float(os.environ.get("RATE_MIN", 0.2))
+
+# 重試預算：每個請求最多重試次數，以及每次成功可累積的重試額度
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", 5))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MIN = float(os.environ.get("RETRY_BUDGET_MIN", 10))
+
+RETRY_BACKOFF_BASE = float(os.environ.get("RETRY_BACKOFF_BASE", 1.0))
+RETRY_BACKOFF_MAX = float(os.environ.get("RETRY_BACKOFF_MAX", 60.0))
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded', 'RATE_LIMIT_EXCEEDED')
+
+def backoff_delay(attempt):
+    """第 attempt 次重試前的等待秒數（指數退避加 full jitter）"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt)))
+
+def is_rate_limited(error):
+    """判斷 HttpError 是否為配額或速率限制錯誤"""
+    status = error.resp.status
+    if status == 429:
+        return True
+    if status == 403:
+        content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else str(error.content)
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+def is_retryable(error):
+    """判斷 HttpError 是否值得重試"""
+    return error.resp.status in RETRYABLE_STATUSES or is_rate_limited(error)
+
+class AdaptiveTokenBucket:
+    """速率會依 AIMD 調整的權杖桶：成功時緩慢提高速率，被限流時減半"""
+
+    def __init__(self, name, rate, max_rate, min_rate=RATE_MIN,
+                 increase=RATE_INCREASE, decrease_factor=RATE_DECREASE_FACTOR):
+        self.name = name
+        self.rate = rate
+        self.max_rate = max(rate, max_rate)
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.throttled = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        # 容量為一秒的量，避免閒置後突然爆量
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, cost=1):
+        """等待直到取得 cost 個權杖"""
+        async with self._lock:
+            while True:
+                self._refill()
+                # 成本超過容量時（例如大批次）允許先借用，之後的請求會等待補足
+                if self.tokens >= min(cost, max(self.rate, 1.0)):
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((min(cost, max(self.rate, 1.0)) - self.tokens) / self.rate)
+
+    def on_success(self):
+        """加法增加：每個成功請求約增加 increase / rate，一秒內約增加 increase"""
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        """乘法減少：被限流時降低速率並清空權杖"""
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.tokens = min(self.tokens, 0.0)
+        self.throttled += 1
+
+class RetryBudget:
+    """限制重試佔總請求的比例，避免錯誤時的重試風暴"""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, minimum=RETRY_BUDGET_MIN, max_attempts=RETRY_MAX_ATTEMPTS):
+        self.ratio = ratio
+        self.capacity = max(minimum, 1.0)
+        self.balance = self.capacity
+        self.max_attempts = max_attempts
+        self.retries = 0
+        self.exhausted = 0
+
+    def on_success(self):
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def try_retry(self, attempt):
+        """attempt 為已重試次數；允許重試時扣除額度並回傳 True"""
+        if attempt >= self.max_attempts or self.balance < 1:
+            self.exhausted += 1
+            return False
+        self.balance -= 1
+        self.retries += 1
+        return True
+
+class RateLimiter:
+    """Drive 讀取、Drive 寫入與 Docs batchUpdate 各自獨立的速率限制與重試預算"""
+
+    def __init__(self):
+        self.buckets = {
+            'read': AdaptiveTokenBucket('read', DRIVE_READ_RATE, DRIVE_READ_MAX_RATE),
+            'write': AdaptiveTokenBucket('write', DRIVE_WRITE_RATE, DRIVE_WRITE_MAX_RATE),
+            'docs': AdaptiveTokenBucket('docs', DOCS_WRITE_RATE, DOCS_WRITE_MAX_RATE),
+        }
+        self.budgets = {kind: RetryBudget() for kind in self.buckets}
+
+    def classify(self, request):
+        """依請求的目標與方法判斷其類別"""
+        uri = getattr(request, "uri", "") or ""
+        method_id = getattr(request, "methodId", "") or ""
+        if "docs.googleapis.com" in uri or method_id.startswith("docs."):
+            return 'docs'
+        if getattr(request, "method", "POST") == "GET":
+            return 'read'
+        return 'write'
+
+rate_limiter = RateLimiter()
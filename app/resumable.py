@@ -0,0 +1,136 @@
+# resumable.py
+
+import os
+import time
+import asyncio
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from drive_async import next_chunk
+from rate_limit import rate_limiter, backoff_delay, is_retryable
+from storage import DATA_DIR, AsyncDatabase
+from metrics import bytes_transferred, google_api_retries
+
+UPLOAD_CHECKPOINT_DB_PATH = os.environ.get("UPLOAD_CHECKPOINT_DB_PATH", os.path.join(DATA_DIR, "uploads.db"))
+# Drive 的續傳工作階段約一週後失效
+UPLOAD_CHECKPOINT_MAX_AGE = float(os.environ.get("UPLOAD_CHECKPOINT_MAX_AGE", 6 * 24 * 3600))
+
+def _create_tables(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS uploads (
+            upload_key TEXT PRIMARY KEY,
+            resumable_uri TEXT NOT NULL,
+            progress INTEGER NOT NULL,
+            size INTEGER,
+            updated_at REAL NOT NULL
+        );
+    """)
+    conn.execute("DELETE FROM uploads WHERE updated_at < ?", (time.time() - UPLOAD_CHECKPOINT_MAX_AGE,))
+    conn.commit()
+
+def _get_checkpoint(conn, upload_key):
+    row = conn.execute(
+        "SELECT resumable_uri, progress, size FROM uploads WHERE upload_key = ?", (upload_key,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {'resumable_uri': row[0], 'progress': row[1], 'size': row[2]}
+
+def _save_checkpoint(conn, upload_key, resumable_uri, progress, size):
+    conn.execute(
+        "INSERT OR REPLACE INTO uploads (upload_key, resumable_uri, progress, size, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (upload_key, resumable_uri, progress, size, time.time())
+    )
+    conn.commit()
+
+def _delete_checkpoint(conn, upload_key):
+    conn.execute("DELETE FROM uploads WHERE upload_key = ?", (upload_key,))
+    conn.commit()
+
+class UploadCheckpoints:
+    """記錄進行中的續傳工作階段 URI 與已上傳位元組數，重新啟動後可從中斷處繼續
+
+    資料庫操作在專用執行緒中執行，等待其他行程的寫入鎖時不會阻塞事件迴圈。
+    """
+
+    def __init__(self, path=UPLOAD_CHECKPOINT_DB_PATH):
+        self.db = AsyncDatabase(path, name="upload-checkpoints")
+        self.db.run_sync(_create_tables)
+
+    async def get(self, upload_key):
+        return await self.db.run(_get_checkpoint, upload_key)
+
+    async def save(self, upload_key, resumable_uri, progress, size):
+        await self.db.run(_save_checkpoint, upload_key, resumable_uri, progress, size)
+
+    async def delete(self, upload_key):
+        await self.db.run(_delete_checkpoint, upload_key)
+
+    def close(self):
+        self.db.close()
+
+upload_checkpoints = UploadCheckpoints()
+
+def _reset_session(request):
+    """放棄目前的工作階段，下次呼叫時重新建立"""
+    request.resumable_uri = None
+    request.resumable_progress = 0
+    request._in_error_state = False
+
+async def upload_resumable(request, upload_key=None):
+    """逐塊執行續傳上傳並記錄進度，遇到暫時性錯誤時退避重試，回傳 API 的回應內容
+
+    upload_key 用於識別同一份內容與目的地；相同 key 的上傳會從先前記錄的位置繼續。
+    重試與一般 Drive 寫入請求共用重試預算，區塊有進展時重新計算重試次數。
+    """
+    size = request.resumable.size()
+
+    if upload_key:
+        checkpoint = await upload_checkpoints.get(upload_key)
+        if checkpoint and checkpoint['size'] == size:
+            # 先向伺服器查詢實際已接收的位元組數，再從該位置繼續
+            request.resumable_uri = checkpoint['resumable_uri']
+            request.resumable_progress = checkpoint['progress']
+            request._in_error_state = True
+
+    budget = rate_limiter.budgets['write']
+    attempt = 0
+    response = None
+    while response is None:
+        progress = request.resumable_progress
+        try:
+            status, response = await next_chunk(request)
+        except HttpError as e:
+            if e.resp.status == 404 and request.resumable_uri:
+                # 工作階段已失效，重新開始上傳
+                print(f"Resumable session expired, restarting upload: {upload_key}")
+                if upload_key:
+                    await upload_checkpoints.delete(upload_key)
+                _reset_session(request)
+                continue
+            if not is_retryable(e) or not budget.try_retry(attempt):
+                raise
+            request._in_error_state = request.resumable_uri is not None
+            print(f"Retrying upload chunk after HTTP {e.resp.status} (attempt {attempt + 1})")
+        except (OSError, httplib2.HttpLib2Error) as e:
+            if not budget.try_retry(attempt):
+                raise
+            request._in_error_state = request.resumable_uri is not None
+            print(f"Retrying upload chunk after {e!r} (attempt {attempt + 1})")
+        else:
+            budget.on_success()
+            if response is None and upload_key and request.resumable_uri:
+                await upload_checkpoints.save(upload_key, request.resumable_uri, request.resumable_progress, size)
+            if request.resumable_progress > progress:
+                attempt = 0
+            continue
+
+        google_api_retries.inc(kind='write')
+        await asyncio.sleep(backoff_delay(attempt))
+        attempt += 1
+
+    if upload_key:
+        await upload_checkpoints.delete(upload_key)
+    bytes_transferred.inc(size, direction="upload")
+    return response
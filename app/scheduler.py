@@ -1,26 +1,155 @@
 # scheduler.py
 
 import os
+import time
 import asyncio
 from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from gdrive import generate_daily_summary
+from storage import DATA_DIR, AsyncDatabase
+from summary import generate_all_daily_summaries, refresh_reports, SUMMARY_UPDATE_DELAY
+from work_queue import MULTI_WORKER
 
-scheduler = BackgroundScheduler()
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-def generate_daily_report():
-    """定時生成每日報告的同步包裝函數"""
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    asyncio.run(generate_daily_summary(yesterday))
-    print(f"Daily report generated for {yesterday}")
+# 排程的執行記錄，重新啟動後據此補跑停機期間錯過的每日報告
+SCHEDULER_DB_PATH = os.environ.get("SCHEDULER_DB_PATH", os.path.join(DATA_DIR, "scheduler.db"))
+# 錯過排定時間多少秒內仍會執行
+SCHEDULER_MISFIRE_GRACE_TIME = int(os.environ.get("SCHEDULER_MISFIRE_GRACE_TIME", 3600))
+# 啟動時最多補跑幾天的報告
+SCHEDULER_CATCHUP_DAYS = int(os.environ.get("SCHEDULER_CATCHUP_DAYS", 7))
+# 多個工作行程時只有取得此檔案鎖的行程執行排程工作
+SCHEDULER_LOCK_PATH = os.environ.get("SCHEDULER_LOCK_PATH", os.path.join(DATA_DIR, "scheduler.lock"))
+# 未取得鎖的行程每隔幾秒重試，原本的行程結束後接手
+SCHEDULER_LEADER_RETRY = float(os.environ.get("SCHEDULER_LEADER_RETRY", 30))
+
+def _create_tables(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS job_runs (
+            job_id TEXT PRIMARY KEY,
+            last_value TEXT NOT NULL,
+            finished_at REAL NOT NULL
+        );
+    """)
+    conn.commit()
+
+def _get_job_value(conn, job_id):
+    row = conn.execute("SELECT last_value FROM job_runs WHERE job_id = ?", (job_id,)).fetchone()
+    return row[0] if row else None
+
+def _set_job_value(conn, job_id, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO job_runs (job_id, last_value, finished_at) VALUES (?, ?, ?)",
+        (job_id, value, time.time())
+    )
+    conn.commit()
+
+class JobState:
+    """記錄每個排程工作最後完成的項目（每日報告為日期）"""
+
+    def __init__(self, path=SCHEDULER_DB_PATH):
+        self.db = AsyncDatabase(path, name="scheduler")
+        self.db.run_sync(_create_tables)
+
+    async def get(self, job_id):
+        return await self.db.run(_get_job_value, job_id)
+
+    async def set(self, job_id, value):
+        await self.db.run(_set_job_value, job_id, value)
+
+    def close(self):
+        self.db.close()
+
+job_state = JobState()
+
+# 排程器在 uvicorn 的事件迴圈上執行，與 webhook 共用連線池、資料夾快取與速率限制
+scheduler = AsyncIOScheduler(job_defaults={
+    'max_instances': 1,
+    'coalesce': True,
+    'misfire_grace_time': SCHEDULER_MISFIRE_GRACE_TIME,
+})
+
+def _missed_dates(last_date, today):
+    """列出 last_date 之後到昨天為止尚未產生報告的日期"""
+    yesterday = today - timedelta(days=1)
+    earliest = today - timedelta(days=SCHEDULER_CATCHUP_DAYS)
+    if last_date:
+        start = max(datetime.strptime(last_date, "%Y-%m-%d").date() + timedelta(days=1), earliest)
+    else:
+        start = max(yesterday, earliest)
+    dates = []
+    while start <= yesterday:
+        dates.append(start.strftime("%Y-%m-%d"))
+        start += timedelta(days=1)
+    return dates
+
+async def generate_daily_report():
+    """生成前一天（以及停機期間錯過的日期）的每日報告"""
+    for date_str in _missed_dates(await job_state.get('daily_report'), datetime.now().date()):
+        reports = await generate_all_daily_summaries(date_str)
+        await job_state.set('daily_report', date_str)
+        print(f"Daily report generated for {date_str} ({len(reports)} folders)")
+
+async def refresh_todays_reports():
+    """更新當日報告（多個工作行程時取代各行程保存後的延遲更新）"""
+    await refresh_reports(datetime.now().strftime("%Y-%m-%d"))
+
+_lock_file = None
+_election_task = None
+
+def _acquire_leadership():
+    """以 flock 取得排程鎖，行程結束時作業系統會自動釋放"""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    if fcntl is None:
+        return True
+    os.makedirs(os.path.dirname(SCHEDULER_LOCK_PATH) or ".", exist_ok=True)
+    lock_file = open(SCHEDULER_LOCK_PATH, "a+")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _lock_file = lock_file
+    return True
+
+def _release_leadership():
+    global _lock_file
+    if _lock_file is not None:
+        fcntl.flock(_lock_file.fileno(), fcntl.LOCK_UN)
+        _lock_file.close()
+        _lock_file = None
+
+async def _wait_for_leadership():
+    """定期嘗試取得排程鎖，取得後啟動排程器"""
+    while not _acquire_leadership():
+        await asyncio.sleep(SCHEDULER_LEADER_RETRY)
+    print(f"Scheduler leadership acquired by process {os.getpid()}")
+    _start_jobs()
 
 def start_scheduler():
-    """啟動排程器"""
+    """啟動排程器（須在事件迴圈中呼叫）；其他行程已在執行排程時改為等待接手"""
+    global _election_task
+    if _acquire_leadership():
+        _start_jobs()
+    else:
+        print(f"Scheduler is running in another process, process {os.getpid()} is standing by")
+        _election_task = asyncio.create_task(_wait_for_leadership(), name="scheduler-election")
+
+def _start_jobs():
     try:
         # 每天午夜 (00:00) 生成前一天的報告
         scheduler.add_job(
@@ -30,18 +159,34 @@ def start_scheduler():
             name='Generate daily summary report',
             replace_existing=True
         )
-        
+
+        # 多個工作行程時只有此行程寫入報告，定期依本地索引更新
+        if MULTI_WORKER:
+            scheduler.add_job(
+                refresh_todays_reports,
+                trigger=IntervalTrigger(seconds=SUMMARY_UPDATE_DELAY),
+                id='refresh_reports',
+                name='Refresh daily summary reports',
+                replace_existing=True
+            )
+
         if not scheduler.running:
             scheduler.start()
             print("Scheduler started")
+
+        # 立即執行一次，補跑停機期間錯過的報告（沒有錯過時不做任何事）
+        scheduler.modify_job('daily_report', next_run_time=datetime.now())
     except Exception as e:
         print(f"Error starting scheduler: {e}")
 
 def stop_scheduler():
-    """停止排程器"""
+    """停止排程器並釋放排程鎖"""
+    if _election_task is not None:
+        _election_task.cancel()
     try:
         if scheduler.running:
-            scheduler.shutdown()
+            scheduler.shutdown(wait=False)
             print("Scheduler stopped")
     except Exception as e:
         print(f"Error stopping scheduler: {e}")
+    _release_leadership()
@@ -0,0 +1,275 @@
+# storage.py
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+# 本地資料目錄（SQLite 資料庫等）
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+
+# 對話狀態儲存後端：memory 或 sqlite
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite").lower()
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", os.path.join(DATA_DIR, "sessions.db"))
+
+MEDIA_KINDS = ('texts', 'photos', 'videos')
+
+def open_database(path):
+    """開啟 SQLite 資料庫並啟用 WAL 模式"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class AsyncDatabase:
+    """在專用執行緒中使用的 SQLite 連線
+
+    多個工作行程爭用寫入鎖時最多會等待數秒，在執行緒中執行可避免阻塞事件迴圈。
+    所有操作依序在同一個執行緒執行，run 傳入的函數第一個參數為連線。
+    """
+
+    def __init__(self, path, name="sqlite"):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.conn = self._executor.submit(open_database, path).result()
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, self.conn, *args)
+
+    def submit(self, fn, *args):
+        """在背景執行，不等待結果"""
+        return self._executor.submit(fn, self.conn, *args)
+
+    def run_sync(self, fn, *args):
+        """在事件迴圈外（初始化或關閉時）同步執行"""
+        return self._executor.submit(fn, self.conn, *args).result()
+
+    def close(self):
+        self.run_sync(lambda conn: conn.close())
+        self._executor.shutdown(wait=True)
+
+class SessionStore:
+    """使用者對話狀態（選擇的資料夾與待保存訊息）的儲存介面"""
+
+    async def get_folder(self, chat_id):
+        raise NotImplementedError
+
+    async def set_folder(self, chat_id, folder_name):
+        raise NotImplementedError
+
+    async def has_pending(self, chat_id):
+        raise NotImplementedError
+
+    async def start_pending(self, chat_id, message_id):
+        """建立待保存訊息，已存在時不變"""
+        raise NotImplementedError
+
+    async def add_item(self, chat_id, kind, item, message_id):
+        """新增一筆待保存項目，回傳該類型目前的數量"""
+        raise NotImplementedError
+
+    async def get_pending(self, chat_id):
+        """回傳 {'texts', 'photos', 'videos', 'message_id'}，沒有時回傳 None"""
+        raise NotImplementedError
+
+    async def replace_pending(self, chat_id, pending):
+        """以 pending 取代待保存訊息（例如只保留保存失敗的項目），沒有任何項目時清除"""
+        raise NotImplementedError
+
+    async def clear_pending(self, chat_id):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MemorySessionStore(SessionStore):
+    """存放於行程記憶體中的對話狀態，重新啟動後會遺失"""
+
+    def __init__(self):
+        self.pending_messages = {}
+        self.user_folder_names = {}
+
+    async def get_folder(self, chat_id):
+        return self.user_folder_names.get(chat_id)
+
+    async def set_folder(self, chat_id, folder_name):
+        self.user_folder_names[chat_id] = folder_name
+
+    async def has_pending(self, chat_id):
+        return bool(self.pending_messages.get(chat_id))
+
+    async def start_pending(self, chat_id, message_id):
+        if not self.pending_messages.get(chat_id):
+            self.pending_messages[chat_id] = {
+                'texts': [],
+                'photos': [],
+                'videos': [],
+                'message_id': message_id
+            }
+
+    async def add_item(self, chat_id, kind, item, message_id):
+        await self.start_pending(chat_id, message_id)
+        items = self.pending_messages[chat_id][kind]
+        items.append(item)
+        return len(items)
+
+    async def get_pending(self, chat_id):
+        return self.pending_messages.get(chat_id)
+
+    async def replace_pending(self, chat_id, pending):
+        if not any(pending[kind] for kind in MEDIA_KINDS):
+            await self.clear_pending(chat_id)
+            return
+        self.pending_messages[chat_id] = {kind: list(pending[kind]) for kind in MEDIA_KINDS}
+        self.pending_messages[chat_id]['message_id'] = pending['message_id']
+
+    async def clear_pending(self, chat_id):
+        self.pending_messages.pop(chat_id, None)
+
+def _create_session_tables(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS folders (
+            chat_id INTEGER PRIMARY KEY,
+            folder_name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            chat_id INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS pending_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS pending_items_chat ON pending_items (chat_id, kind);
+    """)
+    conn.commit()
+
+def _get_folder(conn, chat_id):
+    row = conn.execute("SELECT folder_name FROM folders WHERE chat_id = ?", (chat_id,)).fetchone()
+    return row[0] if row else None
+
+def _set_folder(conn, chat_id, folder_name):
+    conn.execute("INSERT OR REPLACE INTO folders (chat_id, folder_name) VALUES (?, ?)", (chat_id, folder_name))
+    conn.commit()
+
+def _has_pending(conn, chat_id):
+    return conn.execute("SELECT 1 FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone() is not None
+
+def _insert_session(conn, chat_id, message_id):
+    conn.execute(
+        "INSERT OR IGNORE INTO sessions (chat_id, message_id, created_at) VALUES (?, ?, ?)",
+        (chat_id, message_id, time.time())
+    )
+
+def _insert_item(conn, chat_id, kind, item):
+    conn.execute(
+        "INSERT INTO pending_items (chat_id, kind, payload) VALUES (?, ?, ?)",
+        (chat_id, kind, json.dumps(item, ensure_ascii=False))
+    )
+
+def _delete_pending(conn, chat_id):
+    conn.execute("DELETE FROM pending_items WHERE chat_id = ?", (chat_id,))
+    conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+
+def _start_pending(conn, chat_id, message_id):
+    _insert_session(conn, chat_id, message_id)
+    conn.commit()
+
+def _add_item(conn, chat_id, kind, item, message_id):
+    try:
+        _insert_session(conn, chat_id, message_id)
+        _insert_item(conn, chat_id, kind, item)
+        count = conn.execute(
+            "SELECT COUNT(*) FROM pending_items WHERE chat_id = ? AND kind = ?", (chat_id, kind)
+        ).fetchone()[0]
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return count
+
+def _get_pending(conn, chat_id):
+    row = conn.execute("SELECT message_id FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+    if row is None:
+        return None
+
+    pending = {kind: [] for kind in MEDIA_KINDS}
+    pending['message_id'] = row[0]
+    for kind, payload in conn.execute(
+        "SELECT kind, payload FROM pending_items WHERE chat_id = ? ORDER BY id", (chat_id,)
+    ):
+        pending[kind].append(json.loads(payload))
+    return pending
+
+def _replace_pending(conn, chat_id, pending):
+    try:
+        _delete_pending(conn, chat_id)
+        if any(pending[kind] for kind in MEDIA_KINDS):
+            _insert_session(conn, chat_id, pending['message_id'])
+            for kind in MEDIA_KINDS:
+                for item in pending[kind]:
+                    _insert_item(conn, chat_id, kind, item)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _clear_pending(conn, chat_id):
+    _delete_pending(conn, chat_id)
+    conn.commit()
+
+class SQLiteSessionStore(SessionStore):
+    """存放於 SQLite (WAL) 的對話狀態，可跨重新啟動及多個工作行程共用
+
+    每次寫入立即提交，不會在等待期間持有寫入鎖；資料庫操作在專用執行緒中執行，
+    等待其他行程的寫入鎖時不會阻塞事件迴圈。
+    """
+
+    def __init__(self, path=SESSION_DB_PATH):
+        self.path = path
+        self.db = AsyncDatabase(path, name="sessions")
+        self.db.run_sync(_create_session_tables)
+
+    def close(self):
+        self.db.close()
+
+    async def get_folder(self, chat_id):
+        return await self.db.run(_get_folder, chat_id)
+
+    async def set_folder(self, chat_id, folder_name):
+        await self.db.run(_set_folder, chat_id, folder_name)
+
+    async def has_pending(self, chat_id):
+        return await self.db.run(_has_pending, chat_id)
+
+    async def start_pending(self, chat_id, message_id):
+        await self.db.run(_start_pending, chat_id, message_id)
+
+    async def add_item(self, chat_id, kind, item, message_id):
+        return await self.db.run(_add_item, chat_id, kind, item, message_id)
+
+    async def get_pending(self, chat_id):
+        return await self.db.run(_get_pending, chat_id)
+
+    async def replace_pending(self, chat_id, pending):
+        await self.db.run(_replace_pending, chat_id, pending)
+
+    async def clear_pending(self, chat_id):
+        await self.db.run(_clear_pending, chat_id)
+
+def create_session_store():
+    """依照 SESSION_STORE 設定建立儲存後端"""
+    if SESSION_STORE == "memory":
+        return MemorySessionStore()
+    if SESSION_STORE == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown SESSION_STORE: {SESSION_STORE}")
+
+session_store = create_session_store()
@@ -0,0 +1,235 @@
+# summary.py
+
+import os
+import asyncio
+from datetime import datetime
+
+from gdrive import (
+    drive_service, GOOGLE_DRIVE_FOLDER_ID, get_or_create_custom_folder, get_or_create_date_folder, find_folder,
+    list_custom_folders, list_message_folders, write_text_file
+)
+from storage import DATA_DIR, AsyncDatabase
+from catalog import catalog
+from work_queue import MULTI_WORKER
+
+# 每日報告由本地備份索引產生，不需要在午夜重新掃描 Drive；此資料庫記錄各報告的 Drive 檔案
+SUMMARY_DB_PATH = os.environ.get("SUMMARY_DB_PATH", os.path.join(DATA_DIR, "summary.db"))
+# 保存後延遲多少秒更新報告，期間的多次保存合併為一次寫入
+SUMMARY_UPDATE_DELAY = float(os.environ.get("SUMMARY_UPDATE_DELAY", 30))
+# 產生每日報告時同時處理的資料夾數量
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", 4))
+
+def _create_tables(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS reports (
+            folder_name TEXT NOT NULL,
+            date TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            web_link TEXT,
+            entry_count INTEGER NOT NULL,
+            PRIMARY KEY (folder_name, date)
+        );
+    """)
+    conn.commit()
+
+def _get_report(conn, folder_name, date_str):
+    row = conn.execute(
+        "SELECT file_id, web_link, entry_count FROM reports WHERE folder_name = ? AND date = ?",
+        (folder_name, date_str)
+    ).fetchone()
+    if row is None:
+        return None
+    return {'file_id': row[0], 'web_link': row[1], 'entry_count': row[2]}
+
+def _set_report(conn, folder_name, date_str, file_id, web_link, entry_count):
+    conn.execute(
+        "INSERT OR REPLACE INTO reports (folder_name, date, file_id, web_link, entry_count) VALUES (?, ?, ?, ?, ?)",
+        (folder_name, date_str, file_id, web_link, entry_count)
+    )
+    conn.commit()
+
+class ReportIndex:
+    """記錄每份每日報告在 Drive 上的檔案 ID，以及寫入時包含的訊息數量"""
+
+    def __init__(self, path=SUMMARY_DB_PATH):
+        self.db = AsyncDatabase(path, name="summary")
+        self.db.run_sync(_create_tables)
+
+    async def get_report(self, folder_name, date_str):
+        return await self.db.run(_get_report, folder_name, date_str)
+
+    async def set_report(self, folder_name, date_str, file_id, web_link, entry_count):
+        await self.db.run(_set_report, folder_name, date_str, file_id, web_link, entry_count)
+
+    def close(self):
+        self.db.close()
+
+report_index = ReportIndex()
+
+def render_report(custom_folder_name, date_str, lines):
+    """產生報告文字，lines 為每條訊息的說明"""
+    report_content = f"""朋友圈內容彙總報告
+生成時間：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+日期：{date_str}
+分類：{custom_folder_name}
+
+本日共備份 {len(lines)} 條訊息
+
+訊息列表：
+"""
+    for i, line in enumerate(lines, 1):
+        report_content += f"{i}. {line}\n"
+
+    report_content += "\n所有檔案已儲存到 Google Drive，請查看相應的連結。\n"
+    return report_content
+
+def _entry_line(entry):
+    saved_at = datetime.fromtimestamp(entry['saved_at']).strftime("%H:%M:%S")
+    counts = []
+    for label, key in (("文件", 'docs'), ("文字", 'texts'), ("圖片", 'photos'), ("影片", 'videos'), ("封存檔", 'archives')):
+        if entry[key]:
+            counts.append(f"{label} {entry[key]}")
+    return f"message_{entry['message_id']}（{saved_at}，{'、'.join(counts)}）"
+
+async def _write_report(custom_folder_name, date_str, date_folder_id, lines, entry_count):
+    report = await report_index.get_report(custom_folder_name, date_str)
+    file = await write_text_file(
+        date_folder_id,
+        f"daily_summary_{date_str}.txt",
+        render_report(custom_folder_name, date_str, lines),
+        file_id=report['file_id'] if report else None
+    )
+    await report_index.set_report(custom_folder_name, date_str, file['id'], file.get('webViewLink'), entry_count)
+    return file.get('webViewLink')
+
+async def update_report_from_catalog(custom_folder_name, date_str):
+    """以本地備份索引覆寫當日報告"""
+    entries = await catalog.message_entries(custom_folder_name, date_str)
+    if not entries:
+        return None
+
+    custom_folder_id = await get_or_create_custom_folder(custom_folder_name)
+    if not custom_folder_id:
+        return None
+    date_folder_id = await get_or_create_date_folder(custom_folder_id, date_str)
+    if not date_folder_id:
+        return None
+
+    lines = [_entry_line(entry) for entry in entries]
+    return await _write_report(custom_folder_name, date_str, date_folder_id, lines, len(entries))
+
+async def generate_daily_summary(custom_folder_name, date_str):
+    """生成單一資料夾的每日彙總報告，回傳報告連結
+
+    本地索引中有記錄時直接使用索引；否則（例如建立索引之前的日期）分頁列出 Drive 上的訊息資料夾。
+    """
+    if not drive_service:
+        return None
+
+    try:
+        if await catalog.message_entries(custom_folder_name, date_str):
+            return await update_report_from_catalog(custom_folder_name, date_str)
+
+        custom_folder_id = await find_folder(GOOGLE_DRIVE_FOLDER_ID, custom_folder_name)
+        if not custom_folder_id:
+            return None
+        date_folder_id = await find_folder(custom_folder_id, date_str)
+        if not date_folder_id:
+            return None
+
+        message_folders = await list_message_folders(date_folder_id)
+        message_folders.sort(key=lambda folder: folder.get('createdTime', ''))
+        lines = [folder['name'] for folder in message_folders]
+        return await _write_report(custom_folder_name, date_str, date_folder_id, lines, len(lines))
+    except Exception as e:
+        print(f"Error generating daily summary for {custom_folder_name}: {e}")
+        return None
+
+def _report_is_current(report, entries):
+    """報告是否已包含本地索引中的所有訊息"""
+    return report is not None and report['entry_count'] == len(entries)
+
+async def refresh_reports(date_str):
+    """更新有新保存、但報告尚未包含的資料夾
+
+    多個工作行程時由排程行程定期執行，報告只由一個行程寫入，不會同時建立重複的報告檔案。
+    """
+    if not drive_service:
+        return
+
+    for folder_name in await catalog.folders(date_str):
+        report = await report_index.get_report(folder_name, date_str)
+        if _report_is_current(report, await catalog.message_entries(folder_name, date_str)):
+            continue
+        try:
+            await update_report_from_catalog(folder_name, date_str)
+        except Exception as e:
+            print(f"Error updating daily summary for {folder_name}: {e}")
+
+async def generate_all_daily_summaries(date_str):
+    """為所有自定義資料夾生成每日報告，回傳 {資料夾名稱: 報告連結}
+
+    已由保存時的增量更新寫好、且之後沒有新保存的報告不會重寫。
+    """
+    if not drive_service:
+        return {}
+
+    await summary_writer.flush(date_str)
+
+    folder_names = set(await catalog.folders(date_str))
+    try:
+        folder_names.update(folder['name'] for folder in await list_custom_folders())
+    except Exception as e:
+        print(f"Error listing custom folders: {e}")
+
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+    async def summarize(folder_name):
+        report = await report_index.get_report(folder_name, date_str)
+        entries = await catalog.message_entries(folder_name, date_str)
+        if report and (not entries or _report_is_current(report, entries)):
+            return report['web_link']
+        async with semaphore:
+            return await generate_daily_summary(folder_name, date_str)
+
+    folder_names = sorted(folder_names)
+    links = await asyncio.gather(*(summarize(name) for name in folder_names))
+    return {name: link for name, link in zip(folder_names, links) if link}
+
+class SummaryWriter:
+    """保存後延遲更新當日報告，同一份報告在延遲期間的多次保存只寫入一次"""
+
+    def __init__(self, delay=SUMMARY_UPDATE_DELAY):
+        self.delay = delay
+        self._tasks = {}
+
+    def schedule(self, custom_folder_name, date_str):
+        key = (custom_folder_name, date_str)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._update_later(key))
+
+    async def _update_later(self, key):
+        await asyncio.sleep(self.delay)
+        # 先移除再寫入，寫入期間的新保存會排定下一次更新
+        self._tasks.pop(key, None)
+        await self._update(key)
+
+    async def _update(self, key):
+        try:
+            await update_report_from_catalog(*key)
+        except Exception as e:
+            print(f"Error updating daily summary for {key[0]}: {e}")
+
+    async def flush(self, date_str=None):
+        """立即寫入尚未更新的報告（午夜產生報告或關閉時）"""
+        keys = [key for key in self._tasks if date_str is None or key[1] == date_str]
+        for key in keys:
+            self._tasks.pop(key).cancel()
+        await asyncio.gather(*(self._update(key) for key in keys))
+
+summary_writer = SummaryWriter()
+
+def schedule_report_update(custom_folder_name, date_str):
+    """保存後排定更新當日報告；多個工作行程時改由排程行程定期執行 refresh_reports"""
+    if drive_service and not MULTI_WORKER:
+        summary_writer.schedule(custom_folder_name, date_str)
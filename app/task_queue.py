@@ -0,0 +1,97 @@
+# task_queue.py
+
+import os
+import asyncio
+from collections import deque
+
+# 背景工作佇列設定
+TASK_QUEUE_WORKERS = int(os.environ.get("TASK_QUEUE_WORKERS", 4))
+TASK_QUEUE_MAX_SIZE = int(os.environ.get("TASK_QUEUE_MAX_SIZE", 1000))
+TASK_QUEUE_PER_CHAT_ORDERING = os.environ.get("TASK_QUEUE_PER_CHAT_ORDERING", "true").lower() == "true"
+TASK_QUEUE_DRAIN_TIMEOUT = float(os.environ.get("TASK_QUEUE_DRAIN_TIMEOUT", 30))
+
+def chat_key(update):
+    """取得用於排序的聊天 ID，無法判斷時回傳 None"""
+    message = update.get("message") or {}
+    return message.get("chat", {}).get("id")
+
+class TaskQueue:
+    """以工作池處理 Telegram 更新的行程內佇列
+
+    同一個聊天的更新會依照收到的順序逐一處理，不同聊天之間則並行處理。
+    """
+
+    def __init__(self, handler, workers=TASK_QUEUE_WORKERS, maxsize=TASK_QUEUE_MAX_SIZE,
+                 ordered=TASK_QUEUE_PER_CHAT_ORDERING):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.ordered = ordered
+        self._pending = {}
+        self._ready = asyncio.Queue()
+        self._tasks = []
+        self._size = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._accepting = False
+
+    def depth(self):
+        """目前排隊及處理中的更新數量"""
+        return self._size
+
+    def start(self):
+        """啟動工作池"""
+        self._accepting = True
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"task-queue-{i}"))
+
+    async def submit(self, update):
+        """將更新放入佇列，佇列已滿或已停止時回傳 False"""
+        if not self._accepting or self._size >= self.maxsize:
+            return False
+
+        key = chat_key(update) if self.ordered else None
+        if key is None:
+            key = object()
+
+        self._size += 1
+        self._idle.clear()
+        if key in self._pending:
+            # 該聊天已有工作在排隊或處理中，接在後面
+            self._pending[key].append(update)
+        else:
+            self._pending[key] = deque([update])
+            self._ready.put_nowait(key)
+        return True
+
+    async def _worker(self):
+        """從佇列取出聊天並處理其下一個更新"""
+        while True:
+            key = await self._ready.get()
+            updates = self._pending[key]
+            update = updates.popleft()
+            try:
+                await self.handler(update)
+            except Exception as e:
+                print(f"Error processing update: {e}")
+            finally:
+                self._size -= 1
+                if updates:
+                    # 輪流處理，避免單一聊天佔用工作者
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                if self._size == 0:
+                    self._idle.set()
+
+    async def stop(self, timeout=TASK_QUEUE_DRAIN_TIMEOUT):
+        """停止接收新更新，等待佇列處理完畢後關閉工作池"""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Task queue drain timed out with {self._size} updates remaining")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
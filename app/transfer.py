@@ -0,0 +1,104 @@
+# transfer.py
+
+import os
+import mmap
+import asyncio
+import hashlib
+import tempfile
+from googleapiclient.http import MediaIoBaseUpload
+
+from http_client import get_client
+from metrics import observe, bytes_transferred
+
+# Drive 續傳上傳的區塊大小（必須是 256KB 的倍數）
+UPLOAD_CHUNK_SIZE = max(256 * 1024, int(os.environ.get("UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024)) // (256 * 1024) * (256 * 1024))
+# 下載時每次讀取的位元組數
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 64 * 1024))
+
+# 使用自架的 Telegram Bot API 伺服器（--local 模式）時，getFile 回傳伺服器上的檔案路徑，直接從磁碟讀取
+TELEGRAM_LOCAL_MODE = os.environ.get("TELEGRAM_LOCAL_MODE", "false").lower() == "true"
+# Bot API 伺服器與機器人掛載同一個目錄但路徑不同時，以「伺服器路徑=本機路徑」轉換
+TELEGRAM_LOCAL_PATH_MAP = os.environ.get("TELEGRAM_LOCAL_PATH_MAP", "")
+# 可下載的檔案大小上限：官方 Bot API 為 20MB，本地伺服器為 2000MB
+TELEGRAM_FILE_MAX_SIZE = int(os.environ.get(
+    "TELEGRAM_FILE_MAX_SIZE", (2000 if TELEGRAM_LOCAL_MODE else 20) * 1024 * 1024
+))
+
+class FileTooLargeError(Exception):
+    """下載的檔案超過允許的大小"""
+
+async def download_to_file(url, fileobj, max_size=None, timeout=60.0):
+    """以串流方式將檔案下載到 fileobj，回傳 (檔案大小, SHA-256 雜湊)"""
+    size = 0
+    digest = hashlib.sha256()
+    with observe("telegram.download"):
+        async with get_client().stream("GET", url, timeout=timeout) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise FileTooLargeError(f"File exceeds {max_size} bytes")
+                digest.update(chunk)
+                fileobj.write(chunk)
+    bytes_transferred.inc(size, direction="download")
+    return size, digest.hexdigest()
+
+def local_file_source(file_path):
+    """將本地 Bot API 伺服器回傳的檔案路徑轉換為 ('local', 本機路徑)，可在下載網址的位置傳入
+
+    直接傳遞路徑而不轉換為 file:// 網址，檔名中的 #、? 與 % 不會被當作網址語法。
+    """
+    if TELEGRAM_LOCAL_PATH_MAP:
+        remote, _, local = TELEGRAM_LOCAL_PATH_MAP.partition("=")
+        if remote and file_path.startswith(remote):
+            file_path = local + file_path[len(remote):]
+    return ('local', os.path.abspath(file_path))
+
+def is_local_source(source):
+    """是否為 local_file_source 回傳的本地檔案"""
+    return isinstance(source, tuple) and source[0] == 'local'
+
+def _hash_local_file(fileobj, size):
+    # 以 mmap 計算雜湊，不需要將檔案複製到記憶體或暫存檔
+    if not size:
+        return hashlib.sha256().hexdigest()
+    with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return hashlib.sha256(mapped).hexdigest()
+
+async def open_local_file(path, max_size=None):
+    """直接開啟本地檔案，回傳 (檔案物件, 檔案大小, SHA-256 雜湊)"""
+    fileobj = open(path, 'rb')
+    try:
+        size = os.fstat(fileobj.fileno()).st_size
+        if max_size and size > max_size:
+            raise FileTooLargeError(f"File exceeds {max_size} bytes")
+        with observe("telegram.local_read"):
+            content_hash = await asyncio.to_thread(_hash_local_file, fileobj, size)
+    except BaseException:
+        fileobj.close()
+        raise
+    return fileobj, size, content_hash
+
+async def download_to_spool(url, max_size=None, timeout=60.0):
+    """以串流方式下載檔案到暫存檔，回傳 (檔案物件, 檔案大小, SHA-256 雜湊)
+
+    檔案小於一個上傳區塊時保留在記憶體中，否則寫入磁碟，
+    因此每個傳輸的記憶體用量不會超過上傳區塊大小。
+    本地檔案（local_file_source）直接開啟原始檔案，上傳時逐區塊從磁碟讀取。
+    """
+    if is_local_source(url):
+        return await open_local_file(url[1], max_size)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE)
+    try:
+        size, content_hash = await download_to_file(url, spool, max_size, timeout)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool, size, content_hash
+
+def media_upload(fd, mimetype):
+    """建立分塊續傳的 Drive 上傳物件，每次只讀取一個區塊"""
+    return MediaIoBaseUpload(fd, mimetype=mimetype, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
@@ -0,0 +1,247 @@
+# work_queue.py
+
+import os
+import json
+import time
+import uuid
+import asyncio
+
+from storage import DATA_DIR, AsyncDatabase
+from task_queue import chat_key, TASK_QUEUE_WORKERS, TASK_QUEUE_MAX_SIZE, TASK_QUEUE_DRAIN_TIMEOUT
+
+# 工作行程數量，大於 1 時改用跨行程共用的持久化佇列
+WORKERS = int(os.environ.get("WORKERS", 1))
+MULTI_WORKER = WORKERS > 1
+
+WORK_QUEUE_DB_PATH = os.environ.get("WORK_QUEUE_DB_PATH", os.path.join(DATA_DIR, "work_queue.db"))
+# 聊天租約的有效秒數：處理中持續續約，閒置超過此時間後其他行程才能接手該聊天
+WORK_QUEUE_LEASE_SECONDS = float(os.environ.get("WORK_QUEUE_LEASE_SECONDS", 30))
+# 沒有工作時檢查其他行程送入的更新的間隔
+WORK_QUEUE_POLL_INTERVAL = float(os.environ.get("WORK_QUEUE_POLL_INTERVAL", 0.2))
+# 已處理的 update_id 保留多久，用於略過 Telegram 重送的更新
+WORK_QUEUE_RETENTION = float(os.environ.get("WORK_QUEUE_RETENTION", 3600))
+
+def _create_tables(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS updates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            update_id INTEGER UNIQUE,
+            chat_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            done_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS updates_pending ON updates (chat_key, id) WHERE done_at IS NULL;
+        CREATE INDEX IF NOT EXISTS updates_done ON updates (done_at) WHERE done_at IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS chat_leases (
+            chat_key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    """)
+    # 自行控制交易，BEGIN IMMEDIATE 時取得寫入鎖
+    conn.isolation_level = None
+
+def _count_pending(conn):
+    return conn.execute("SELECT COUNT(*) FROM updates WHERE done_at IS NULL").fetchone()[0]
+
+def _insert_update(conn, update_id, key, payload, maxsize):
+    """寫入更新，回傳 'added'、'replay' 或 'full'"""
+    if _count_pending(conn) >= maxsize:
+        return 'full'
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO updates (update_id, chat_key, payload, created_at) VALUES (?, ?, ?, ?)",
+        (update_id, key, payload, time.time())
+    )
+    return 'added' if cursor.rowcount else 'replay'
+
+def _select_claimable(conn, owner, active, now):
+    placeholders = ",".join("?" * len(active))
+    return conn.execute(f"""
+        SELECT u.id, u.chat_key, u.payload FROM updates u
+        LEFT JOIN chat_leases l ON l.chat_key = u.chat_key
+        WHERE u.done_at IS NULL
+          AND u.id = (SELECT MIN(id) FROM updates WHERE chat_key = u.chat_key AND done_at IS NULL)
+          AND (l.owner IS NULL OR l.owner = ? OR l.expires_at < ?)
+          AND u.chat_key NOT IN ({placeholders})
+        ORDER BY u.id LIMIT 1
+    """, (owner, now, *active)).fetchone()
+
+def _claim(conn, owner, active, lease_seconds):
+    """取得一個可處理的更新：該聊天最早的未完成更新，且租約屬於本行程或已過期"""
+    now = time.time()
+    # 先以唯讀查詢確認有工作，避免閒置時每次輪詢都取得寫入鎖
+    if _select_claimable(conn, owner, active, now) is None:
+        return None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = _select_claimable(conn, owner, active, now)
+        if row is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_leases (chat_key, owner, expires_at) VALUES (?, ?, ?)",
+                (row[1], owner, now + lease_seconds)
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+def _complete(conn, row_id, key, owner, lease_seconds):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("UPDATE updates SET done_at = ? WHERE id = ?", (now, row_id))
+        conn.execute(
+            "UPDATE chat_leases SET expires_at = ? WHERE chat_key = ? AND owner = ?",
+            (now + lease_seconds, key, owner)
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def _maintain(conn, owner, active, lease_seconds, retention):
+    """為處理中的聊天續約並清除過期記錄，回傳未完成的更新數量"""
+    now = time.time()
+    for key in active:
+        conn.execute(
+            "UPDATE chat_leases SET expires_at = ? WHERE chat_key = ? AND owner = ?",
+            (now + lease_seconds, key, owner)
+        )
+    conn.execute("DELETE FROM updates WHERE done_at < ?", (now - retention,))
+    conn.execute("DELETE FROM chat_leases WHERE expires_at < ?", (now - lease_seconds,))
+    return _count_pending(conn)
+
+def _release_leases(conn, owner):
+    conn.execute("DELETE FROM chat_leases WHERE owner = ?", (owner,))
+
+class DurableTaskQueue:
+    """存放於 SQLite 的 Telegram 更新佇列，由多個工作行程共用
+
+    介面與 TaskQueue 相同。每個聊天由取得租約的行程處理，依收到的順序逐一執行；
+    租約在處理期間持續續約，閒置一段時間後才釋放，因此相簿緩衝等行程內狀態會留在同一個行程。
+    行程中止時租約過期，未完成的更新由其他行程重新處理。update_id 為唯一鍵，重送的更新只會處理一次。
+    資料庫操作在專用執行緒中執行，等待其他行程的寫入鎖時不會阻塞 webhook。
+    """
+
+    def __init__(self, handler, workers=TASK_QUEUE_WORKERS, maxsize=TASK_QUEUE_MAX_SIZE,
+                 path=WORK_QUEUE_DB_PATH, lease_seconds=WORK_QUEUE_LEASE_SECONDS,
+                 poll_interval=WORK_QUEUE_POLL_INTERVAL, retention=WORK_QUEUE_RETENTION):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.db = AsyncDatabase(path, name="work-queue")
+        self.db.run_sync(_create_tables)
+        # webhook 寫入使用另一個連線，不會排在等待寫入鎖的取出操作後面
+        self.submit_db = AsyncDatabase(path, name="work-queue-submit")
+        self.submit_db.run_sync(_create_tables)
+        self._depth = self.db.run_sync(_count_pending)
+        self._active = set()
+        # 同一行程的工作逐一取出，確保取出的聊天加入 _active 後下一個工作才會查詢
+        self._claim_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._accepting = False
+        self.replays = 0
+
+    def depth(self):
+        """所有行程尚未處理完成的更新數量（定期更新的近似值）"""
+        return self._depth
+
+    def start(self):
+        """啟動工作池與續約工作"""
+        self._accepting = True
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"work-queue-{i}"))
+        self._tasks.append(asyncio.create_task(self._maintain(), name="work-queue-leases"))
+
+    async def submit(self, update):
+        """將更新寫入佇列，佇列已滿或已停止時回傳 False；已收過的 update_id 直接視為成功"""
+        if not self._accepting:
+            return False
+
+        key = chat_key(update)
+        update_id = update.get("update_id")
+        # 無法判斷聊天的更新各自獨立處理
+        key = str(key) if key is not None else f"update:{update_id if update_id is not None else uuid.uuid4().hex}"
+        result = await self.submit_db.run(
+            _insert_update, update_id, key, json.dumps(update, ensure_ascii=False), self.maxsize
+        )
+        if result == 'full':
+            return False
+        if result == 'replay':
+            self.replays += 1
+        else:
+            self._depth += 1
+        self._wakeup.set()
+        return True
+
+    async def _worker(self):
+        """取出可處理的更新並執行，沒有工作時等待本行程送入或定期檢查"""
+        while True:
+            try:
+                # 停止時不再取出新的更新，留給其他行程處理
+                row = None
+                if self._accepting:
+                    async with self._claim_lock:
+                        row = await self.db.run(_claim, self.owner, list(self._active), self.lease_seconds)
+                        if row is not None:
+                            self._active.add(row[1])
+            except Exception as e:
+                print(f"Error claiming update: {e}")
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            row_id, key, payload = row
+            try:
+                await self.handler(json.loads(payload))
+            except Exception as e:
+                print(f"Error processing update: {e}")
+            finally:
+                # 被取消時不標記完成，由下一個取得租約的行程重新處理
+                self._active.discard(key)
+            try:
+                await self.db.run(_complete, row_id, key, self.owner, self.lease_seconds)
+                self._depth = max(0, self._depth - 1)
+            except Exception as e:
+                print(f"Error completing update: {e}")
+            # 同一個聊天可能還有下一個更新
+            self._wakeup.set()
+
+    async def _maintain(self):
+        """定期為處理中的聊天續約，並清除超過保留時間的記錄"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                self._depth = await self.db.run(
+                    _maintain, self.owner, list(self._active), self.lease_seconds, self.retention
+                )
+            except Exception as e:
+                print(f"Error maintaining work queue: {e}")
+
+    async def stop(self, timeout=TASK_QUEUE_DRAIN_TIMEOUT):
+        """停止接收新更新並等待處理中的更新完成；尚未開始的更新留在佇列由其他行程處理"""
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        while self._active and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._active:
+            print(f"Work queue drain timed out with {len(self._active)} updates in progress")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 釋放租約，讓其他行程立即接手
+        await self.db.run(_release_leases, self.owner)
+        self.db.close()
+        self.submit_db.close()
@@ -0,0 +1,331 @@
+# fake_servers.py
+"""模擬 Telegram Bot API 與 Google Drive v3 / Docs v1 的本地伺服器，供 bench/run.py 使用
+
+延遲、錯誤率與配額都可設定；GET /_stats 回傳各端點的呼叫次數。
+
+    python bench/fake_servers.py --port 8900 --latency-ms 50 --error-rate 0.01 --quota-rps 20
+"""
+
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+from email.parser import BytesParser
+from urllib.parse import urlsplit, parse_qsl
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_FILE_SIZE = 200 * 1024
+
+class FakeBackend:
+    """記憶體中的 Drive 檔案、續傳工作階段與呼叫統計"""
+
+    def __init__(self, latency_ms=0.0, error_rate=0.0, quota_rps=0.0, telegram_rps=30.0):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.quota_rps = quota_rps
+        self.telegram_rps = telegram_rps
+        self.reset()
+
+    def reset(self):
+        self.files = {}
+        self.uploads = {}
+        self.calls = Counter()
+        self.errors = Counter()
+        self.message_id = 0
+        self._windows = {}
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+    def _over_limit(self, name, rate):
+        """每秒請求數超過 rate 時回傳 True"""
+        if not rate:
+            return False
+        second = int(time.monotonic())
+        window_second, count = self._windows.get(name, (second, 0))
+        if window_second != second:
+            count = 0
+        self._windows[name] = (second, count + 1)
+        return count + 1 > rate
+
+    def google_failure(self):
+        """依配額與錯誤率決定是否回傳錯誤，回傳 (狀態碼, 內容) 或 None"""
+        if self._over_limit('google', self.quota_rps):
+            self.errors['google.quota'] += 1
+            return 403, {'error': {'code': 403, 'message': 'User rate limit exceeded',
+                                   'errors': [{'reason': 'userRateLimitExceeded'}]}}
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors['google.5xx'] += 1
+            return 503, {'error': {'code': 503, 'message': 'Backend Error'}}
+        return None
+
+    def telegram_failure(self):
+        if self._over_limit('telegram', self.telegram_rps):
+            self.errors['telegram.429'] += 1
+            return {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                    'parameters': {'retry_after': 1}}
+        return None
+
+    def new_file(self, metadata, size=None):
+        file_id = metadata.get('id') or uuid.uuid4().hex
+        file = {
+            'id': file_id,
+            'name': metadata.get('name', 'untitled'),
+            'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+            'parents': metadata.get('parents', []),
+            'description': metadata.get('description', ''),
+            'createdTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+            'webViewLink': f"https://drive.example/file/{file_id}",
+        }
+        if size is not None:
+            file['size'] = str(size)
+        self.files[file_id] = file
+        return file
+
+    def list_files(self, query, page_size, page_token):
+        name = re.search(r"name='((?:[^'\\]|\\.)*)'", query)
+        mime_type = re.search(r"mimeType='([^']*)'", query)
+        parent = re.search(r"'([^']+)' in parents", query)
+        matches = [
+            file for file in self.files.values()
+            if (not name or file['name'] == re.sub(r"\\(.)", r"\1", name.group(1)))
+            and (not mime_type or file['mimeType'] == mime_type.group(1))
+            and (not parent or parent.group(1) in file['parents'])
+        ]
+        start = int(page_token or 0)
+        result = {'files': matches[start:start + page_size]}
+        if start + page_size < len(matches):
+            result['nextPageToken'] = str(start + page_size)
+        return result
+
+    def drive_api(self, method, path, query, body):
+        """處理 Drive 中繼資料請求（直接呼叫與批次請求共用），回傳 (狀態碼, 內容)"""
+        parts = path.strip('/').split('/')
+        if parts == ['files'] and method == 'GET':
+            self.calls['drive.files.list'] += 1
+            return 200, self.list_files(query.get('q', ''), int(query.get('pageSize', 100)), query.get('pageToken'))
+        if parts == ['files', 'generateIds']:
+            self.calls['drive.files.generateIds'] += 1
+            return 200, {'ids': [uuid.uuid4().hex for _ in range(int(query.get('count', 10)))]}
+        if parts == ['files'] and method == 'POST':
+            self.calls['drive.files.create'] += 1
+            if (body or {}).get('id') in self.files:
+                return 409, {'error': {'code': 409, 'message': 'A file already exists with the provided ID'}}
+            return 200, self.new_file(body or {})
+        if len(parts) == 2 and parts[0] == 'files':
+            file = self.files.get(parts[1])
+            if method == 'GET':
+                self.calls['drive.files.get'] += 1
+            elif method == 'PATCH':
+                self.calls['drive.files.update'] += 1
+                if file:
+                    file.update(body or {})
+            elif method == 'DELETE':
+                self.calls['drive.files.delete'] += 1
+                self.files.pop(parts[1], None)
+                return 204, {}
+            if not file:
+                return 404, {'error': {'code': 404, 'message': 'File not found'}}
+            return 200, file
+        return 404, {'error': {'code': 404, 'message': f'Unknown path {path}'}}
+
+def _json_response(status, body, headers=None):
+    return JSONResponse(status_code=status, content=body, headers=headers)
+
+def _parse_multipart(content_type, data):
+    message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + data)
+    return message.get_payload()
+
+def create_app(backend):
+    app = FastAPI()
+
+    # ---- Google OAuth ----
+
+    @app.post("/token")
+    async def token():
+        backend.calls['oauth.token'] += 1
+        return {'access_token': 'bench-token', 'expires_in': 3600, 'token_type': 'Bearer'}
+
+    # ---- Google Drive ----
+
+    @app.api_route("/drive/v3/{path:path}", methods=["GET", "POST", "PATCH", "DELETE"])
+    async def drive(path: str, request: Request):
+        await backend.delay()
+        failure = backend.google_failure()
+        if failure:
+            return _json_response(*failure)
+        data = await request.body()
+        body = json.loads(data) if data else None
+        return _json_response(*backend.drive_api(request.method, path, dict(request.query_params), body))
+
+    @app.post("/upload/drive/v3/files")
+    async def upload_create(request: Request):
+        await backend.delay()
+        failure = backend.google_failure()
+        if failure:
+            return _json_response(*failure)
+        upload_type = request.query_params.get('uploadType')
+        data = await request.body()
+        if upload_type == 'resumable':
+            backend.calls['drive.upload.start'] += 1
+            session_id = uuid.uuid4().hex
+            backend.uploads[session_id] = {'metadata': json.loads(data) if data else {}, 'received': 0, 'file_id': None}
+            location = f"{request.base_url}upload/drive/v3/files?uploadType=resumable&upload_id={session_id}"
+            return Response(status_code=200, headers={'Location': location})
+        # multipart：第一部分為中繼資料，第二部分為內容
+        backend.calls['drive.upload.multipart'] += 1
+        metadata, media = _parse_multipart(request.headers['content-type'], data)
+        file = backend.new_file(json.loads(metadata.get_payload()), size=len(media.get_payload(decode=True) or b''))
+        return file
+
+    @app.put("/upload/drive/v3/files")
+    async def upload_chunk(request: Request):
+        await backend.delay()
+        session = backend.uploads.get(request.query_params.get('upload_id'))
+        if session is None:
+            return _json_response(404, {'error': {'code': 404, 'message': 'Upload session not found'}})
+        data = await request.body()
+        content_range = request.headers.get('content-range', '')
+        if data:
+            backend.calls['drive.upload.chunk'] += 1
+            failure = backend.google_failure()
+            if failure:
+                return _json_response(*failure)
+            match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+            if match and int(match.group(1)) == session['received']:
+                session['received'] = int(match.group(2)) + 1
+        else:
+            backend.calls['drive.upload.status'] += 1
+        total = content_range.rsplit('/', 1)[-1]
+        if total != '*' and session['received'] >= int(total):
+            if session['file_id'] is None:
+                session['file_id'] = backend.new_file(session['metadata'], size=session['received'])['id']
+            return backend.files[session['file_id']]
+        headers = {'Range': f"bytes=0-{session['received'] - 1}"} if session['received'] else {}
+        return Response(status_code=308, headers=headers)
+
+    @app.patch("/upload/drive/v3/files/{file_id}")
+    async def upload_update(file_id: str, request: Request):
+        await backend.delay()
+        failure = backend.google_failure()
+        if failure:
+            return _json_response(*failure)
+        backend.calls['drive.upload.update'] += 1
+        file = backend.files.get(file_id)
+        if file is None:
+            return _json_response(404, {'error': {'code': 404, 'message': 'File not found'}})
+        data = await request.body()
+        if request.query_params.get('uploadType') == 'multipart':
+            _, media = _parse_multipart(request.headers['content-type'], data)
+            file['size'] = str(len(media.get_payload(decode=True) or b''))
+        return file
+
+    @app.post("/batch/drive/v3")
+    async def batch(request: Request):
+        await backend.delay()
+        failure = backend.google_failure()
+        if failure:
+            return _json_response(*failure)
+        backend.calls['drive.batch'] += 1
+        boundary = uuid.uuid4().hex
+        responses = []
+        for part in _parse_multipart(request.headers['content-type'], await request.body()):
+            raw = part.get_payload(decode=True) or part.get_payload().encode()
+            head, _, body = raw.partition(b"\r\n\r\n") if b"\r\n\r\n" in raw else raw.partition(b"\n\n")
+            method, target, _ = head.decode().splitlines()[0].split(" ", 2)
+            url = urlsplit(target)
+            status, content = backend.drive_api(method, url.path.replace('/drive/v3', '', 1), dict(parse_qsl(url.query)),
+                                                json.loads(body) if body.strip() else None)
+            reason = 'OK' if status < 400 else 'Error'
+            responses.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n\r\n{json.dumps(content)}\r\n"
+            )
+        return Response("".join(responses) + f"--{boundary}--\r\n", media_type=f"multipart/mixed; boundary={boundary}")
+
+    # ---- Google Docs ----
+
+    @app.post("/v1/documents/{document_id}:batchUpdate")
+    async def docs_batch_update(document_id: str, request: Request):
+        await backend.delay()
+        failure = backend.google_failure()
+        if failure:
+            return _json_response(*failure)
+        backend.calls['docs.documents.batchUpdate'] += 1
+        body = await request.json()
+        return {'documentId': document_id, 'replies': [{} for _ in body.get('requests', [])]}
+
+    # ---- Telegram Bot API ----
+
+    @app.api_route("/bot{token}/getFile", methods=["GET", "POST"])
+    async def get_file(token: str, request: Request):
+        await backend.delay()
+        backend.calls['telegram.getFile'] += 1
+        file_id = request.query_params.get('file_id')
+        return {'ok': True, 'result': {'file_id': file_id, 'file_path': f"files/{file_id}"}}
+
+    @app.get("/file/bot{token}/files/{file_id}")
+    async def download(token: str, file_id: str):
+        await backend.delay()
+        backend.calls['telegram.download'] += 1
+        # file_id 結尾的數字為檔案大小；內容以 file_id 開頭，避免被視為重複檔案
+        match = re.search(r"_(\d+)$", file_id)
+        size = int(match.group(1)) if match else DEFAULT_FILE_SIZE
+        prefix = file_id.encode()
+
+        async def content():
+            remaining = size
+            block = (prefix + b"\0" * 65536)[:65536]
+            while remaining > 0:
+                yield block[:remaining]
+                remaining -= len(block)
+
+        return StreamingResponse(content(), media_type="application/octet-stream", headers={'Content-Length': str(size)})
+
+    @app.post("/bot{token}/{method}")
+    async def bot_method(token: str, method: str):
+        await backend.delay()
+        backend.calls[f'telegram.{method}'] += 1
+        failure = backend.telegram_failure()
+        if failure:
+            return _json_response(429, failure)
+        backend.message_id += 1
+        return {'ok': True, 'result': {'message_id': backend.message_id}}
+
+    # ---- 統計 ----
+
+    @app.get("/_stats")
+    async def stats():
+        return {'calls': dict(backend.calls), 'errors': dict(backend.errors), 'files': len(backend.files)}
+
+    @app.post("/_reset")
+    async def reset():
+        backend.reset()
+        return {'ok': True}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="平均回應延遲（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Google API 回傳 503 的比例")
+    parser.add_argument("--quota-rps", type=float, default=0.0, help="Google API 每秒配額，0 為不限制")
+    parser.add_argument("--telegram-rps", type=float, default=30.0, help="Telegram 每秒發送訊息上限，超過回傳 429")
+    args = parser.parse_args()
+
+    backend = FakeBackend(args.latency_ms, args.error_rate, args.quota_rps, args.telegram_rps)
+    uvicorn.run(create_app(backend), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
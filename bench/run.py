@@ -0,0 +1,219 @@
+# run.py
+"""以本地模擬的 Telegram 與 Google 伺服器對 main.app 進行負載測試，結果以 JSON 輸出
+
+每個聊天依序送出：設定資料夾、一組相簿（media_group_id）、影片、文字，最後 /save；
+所有聊天同時進行，模擬 /save 尖峰。
+
+    python bench/run.py --chats 20 --album-size 9 --video-mb 20 --latency-ms 50 --output result.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import resource
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+BOT_TOKEN = "bench:token"
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _service_account(token_uri):
+    """產生只在模擬伺服器上使用的服務帳戶金鑰"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return json.dumps({
+        'type': 'service_account',
+        'project_id': 'bench',
+        'private_key_id': 'bench',
+        'private_key': pem,
+        'client_email': 'bench@bench.iam.gserviceaccount.com',
+        'client_id': '0',
+        'token_uri': token_uri,
+    })
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(percent / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+def chat_updates(chat_id, args, next_update_id):
+    """產生一個聊天的更新序列"""
+    message_id = chat_id * 1000
+    updates = []
+
+    def message(**fields):
+        nonlocal message_id
+        message_id += 1
+        fields.update({'message_id': message_id, 'chat': {'id': chat_id}})
+        return {'update_id': next_update_id(), 'message': fields}
+
+    updates.append(message(text=f"bench-{chat_id % args.folders}"))
+    photo_size = args.photo_kb * 1024
+    for i in range(args.album_size):
+        file_id = f"photo_{chat_id}_{i}_{photo_size}"
+        updates.append(message(
+            media_group_id=f"album-{chat_id}",
+            caption="bench album" if i == 0 else "",
+            photo=[{'file_id': file_id, 'file_unique_id': f"u{file_id}", 'file_size': photo_size}]
+        ))
+    video_size = int(args.video_mb * 1024 * 1024)
+    for i in range(args.videos):
+        file_id = f"video_{chat_id}_{i}_{video_size}"
+        updates.append(message(video={'file_id': file_id, 'file_unique_id': f"u{file_id}", 'file_size': video_size}))
+    for i in range(args.texts):
+        updates.append(message(text=f"bench text {chat_id}-{i} " + "朋友圈內容 " * 20))
+    updates.append(message(text="/save"))
+    return updates
+
+async def run(args, fake_url):
+    # 匯入前設定環境變數，讓 bot 與 gdrive 連到模擬伺服器
+    sys.path.insert(0, APP_DIR)
+    import main
+    import metrics
+
+    latencies = []
+    statuses = {}
+
+    async def post(client, update):
+        start = time.perf_counter()
+        response = await client.post(f"/{BOT_TOKEN}", json=update)
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    def saves_done():
+        entry = metrics.save_seconds._values.get(())
+        return entry['count'] if entry else 0
+
+    await main.startup_event()
+    async with httpx.AsyncClient(base_url=fake_url) as fake:
+        await fake.post("/_reset")
+
+    counter = iter(range(1, 10 ** 9))
+    streams = [chat_updates(chat_id, args, lambda: next(counter)) for chat_id in range(1, args.chats + 1)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bot") as client:
+        async def replay(updates):
+            async with semaphore:
+                for update in updates:
+                    await post(client, update)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(replay(updates) for updates in streams))
+        deadline = time.monotonic() + args.timeout
+        while saves_done() < args.chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+    completed = saves_done()
+    await main.shutdown_event()
+
+    async with httpx.AsyncClient(base_url=fake_url) as fake:
+        stats = (await fake.get("/_stats")).json()
+
+    calls = stats['calls']
+    google_calls = sum(count for name, count in calls.items() if not name.startswith(('telegram.', 'oauth.')))
+    telegram_calls = sum(count for name, count in calls.items() if name.startswith('telegram.'))
+    per_save = lambda count: round(count / completed, 2) if completed else None
+
+    return {
+        'config': vars(args),
+        'updates': len(latencies),
+        'webhook_status': statuses,
+        'webhook_latency_ms': {
+            'p50': round(_percentile(latencies, 50) * 1000, 3),
+            'p95': round(_percentile(latencies, 95) * 1000, 3),
+            'p99': round(_percentile(latencies, 99) * 1000, 3),
+            'max': round(max(latencies) * 1000, 3),
+        },
+        'saves_completed': completed,
+        'duration_s': round(elapsed, 3),
+        'saves_per_sec': round(completed / elapsed, 3) if elapsed else None,
+        # Linux 上 ru_maxrss 的單位為 KB
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'api_calls': calls,
+        'api_errors_injected': stats['errors'],
+        'api_calls_per_save': {
+            'google': per_save(google_calls),
+            'telegram': per_save(telegram_calls),
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=10, help="同時進行 /save 的聊天數")
+    parser.add_argument("--folders", type=int, default=3, help="聊天分散到的自定義資料夾數")
+    parser.add_argument("--album-size", type=int, default=9)
+    parser.add_argument("--photo-kb", type=int, default=300)
+    parser.add_argument("--videos", type=int, default=1)
+    parser.add_argument("--video-mb", type=float, default=5)
+    parser.add_argument("--texts", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=50, help="同時送出更新的聊天數上限")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-rps", type=float, default=0.0)
+    parser.add_argument("--telegram-rps", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=600.0, help="等待所有 /save 完成的秒數上限")
+    parser.add_argument("--output", help="另外將結果寫入此檔案")
+    args = parser.parse_args()
+
+    port = _free_port()
+    fake_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_servers.py"), "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate),
+        "--quota-rps", str(args.quota_rps), "--telegram-rps", str(args.telegram_rps),
+    ])
+
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{fake_url}/_stats")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+
+        data_dir = tempfile.mkdtemp(prefix="wechat-backup-bench-")
+        os.environ.update({
+            'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+            'TELEGRAM_API_BASE': fake_url,
+            'GOOGLE_API_ENDPOINT': fake_url,
+            'GOOGLE_SERVICE_ACCOUNT_JSON': _service_account(f"{fake_url}/token"),
+            'GOOGLE_DRIVE_FOLDER_ID': 'bench-root',
+            'DATA_DIR': data_dir,
+            'SCHEDULER_CATCHUP_DAYS': '0',
+        })
+
+        result = asyncio.run(run(args, fake_url))
+    finally:
+        server.terminate()
+        server.wait()
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()